@@ -1,10 +1,14 @@
 """ This file is the entry point of the application. It creates the Flask app instance and returns it. """
 
+from os import getenv
 from flask import Flask
-from app.models import db
+from app.models import db, get_text_image_columns
+from app.models.engine import set_statement_timeout_per_transaction
 from configuration import config
 from .utils.utils import mail
 from .routes import auth, user, resnet, patient, owner
+from .routes.resnet_model.resnet_model import get_model, get_model_artifact
+from .commands import database_cli, images_cli, model_cli, owners_cli, photos_cli
 
 
 def create_app(config_name: str):
@@ -14,10 +18,32 @@ def create_app(config_name: str):
     mail.init_app(app)
     with app.app_context():
         db.init_app(app)
+        engine_is_postgres = db.engine.dialect.name == "postgresql"
+        if engine_is_postgres and app.config["DB_POOL_MODE"] == "transaction" and app.config["DB_STATEMENT_TIMEOUT_MS"]:
+            set_statement_timeout_per_transaction(db.engine, app.config["DB_STATEMENT_TIMEOUT_MS"])
         db.create_all()
+        text_columns = [f"{column.class_.__tablename__}.{column.key}" for column in get_text_image_columns()]
+        if text_columns:
+            app.logger.error(
+                "The image columns %s are still base64 text, run flask images convert", ", ".join(text_columns)
+            )
+        # Not when the model runs in the inference server, nor for the flask commands: the ones needing the model load it
+        # themselves, the others (release steps, benchmark) must not wait for the weights nor download them
+        serves_model = not app.config["INFERENCE_SERVER_ADDRESS"] and getenv("FLASK_RUN_FROM_CLI") != "true"
+        if serves_model and app.config["MODEL_PRELOAD"]:
+            # Load the model once at startup so the first request does not pay for it
+            get_model()
+        elif serves_model:
+            # Start fetching the weights in the background if they are missing, without blocking the startup
+            get_model_artifact().prefetch()
     app.register_blueprint(auth, url_prefix="/auth")
     app.register_blueprint(user, url_prefix="/users")
     app.register_blueprint(resnet, url_prefix="/resnet")
     app.register_blueprint(patient, url_prefix="/patients")
     app.register_blueprint(owner, url_prefix="/owners")
+    app.cli.add_command(database_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(model_cli)
+    app.cli.add_command(owners_cli)
+    app.cli.add_command(photos_cli)
     return app
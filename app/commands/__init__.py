@@ -0,0 +1,7 @@
+"""This module initializes the CLI commands for the application."""
+
+from .database import database_cli
+from .images import images_cli
+from .model import model_cli
+from .owners import owners_cli
+from .photos import photos_cli
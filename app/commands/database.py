@@ -0,0 +1,64 @@
+"""This module contains the flask CLI commands to maintain the database schema."""
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app.models import Patient, Photo, User, db
+
+database_cli = AppGroup("database", help="Maintain the database schema.")
+
+# Columns added to the models after their tables were first created, create_all does not add them to existing tables
+ADDED_COLUMNS = [
+    User.profile_picture_hash,
+    Patient.profile_photo_hash,
+    Photo.photo_hash,
+    Photo.model_version,
+    Photo.analysis_status,
+    Photo.analysis_error,
+]
+
+
+def add_column(connection, column) -> None:
+    """Add a nullable column of a model to its table if it is missing"""
+    preparer = connection.dialect.identifier_preparer
+    table = preparer.format_table(column.table)
+    definition = f"{preparer.quote(column.name)} {column.type.compile(dialect=connection.dialect)}"
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {definition}"))
+    elif column.name not in {info["name"] for info in inspect(connection).get_columns(column.table.name)}:
+        # SQLite has no ADD COLUMN IF NOT EXISTS
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {definition}"))
+
+
+@database_cli.command("upgrade")
+def upgrade():
+    """Add the columns of the models missing in the tables created before (ADDED_COLUMNS)
+    It must run before the app serves requests, the models load these columns: it is the first release command of the
+    Procfile. It does nothing once the columns exist.
+    Example: flask database upgrade
+    """
+    with db.engine.begin() as connection:
+        for column in ADDED_COLUMNS:
+            add_column(connection, column.property.columns[0])
+            click.echo(f"{column.class_.__tablename__}.{column.key} ready")
+    click.echo("Done")
+
+
+@database_cli.command("indexes")
+def indexes():
+    """Create the indexes of the models missing in the database
+    The tables created by the app already have them, but create_all does not add the indexes to the tables that exist,
+    this is for the databases created before (the foreign keys of the ownership checks and the trigram indexes of the
+    searches). On PostgreSQL the pg_trgm extension is created first (it requires the CREATE privilege on the database).
+    Example: flask database indexes
+    """
+    with db.engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for table in db.metadata.sorted_tables:
+            for table_index in sorted(table.indexes, key=lambda table_index: table_index.name):
+                # IF NOT EXISTS instead of checkfirst: the expression indexes are not reflected
+                connection.execute(CreateIndex(table_index, if_not_exists=True))
+                click.echo(f"{table_index.name} ready")
+    click.echo("Done")
@@ -0,0 +1,131 @@
+"""This module contains the flask CLI commands to maintain the stored images."""
+
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app.models import (
+    IMAGE_COLUMNS,
+    bulk_update_rows,
+    convert_image_column,
+    get_images_after,
+    get_text_image_columns,
+    get_thumbnail_sizes,
+    save_thumbnails,
+)
+from app.utils.image_storage import get_image_storage, image_hash
+from app.utils.thumbnails import make_thumbnails
+
+images_cli = AppGroup("images", help="Maintain the stored images.")
+
+
+@images_cli.command("convert")
+def convert():
+    """Convert the legacy base64 text image columns to bytea in place (PostgreSQL only)
+    The models map the image columns to bytea, the app can not read nor write a text column, so this must run before
+    the app serves requests: it is the release command of the Procfile. Converting rewrites the table under an
+    exclusive lock. It does nothing once the columns are bytea.
+    Example: flask images convert
+    """
+    columns = get_text_image_columns()
+    for column in columns:
+        convert_image_column(column)
+        click.echo(f"{column.class_.__tablename__}.{column.key} converted to bytea")
+    if not columns:
+        click.echo("No base64 text image column to convert")
+
+
+@images_cli.command("hashes")
+@click.option("--chunk-size", default=256, show_default=True, help="Rows read from the database per chunk.")
+def hashes(chunk_size):
+    """Fill the missing hashes of the stored images
+    The image URLs and ETags come from the hash columns, the images stored before they were added have none (no URL
+    is returned for them). Only the rows without a hash are read, so it is quick once they are filled: it is a release
+    command of the Procfile, after flask images convert.
+    Example: flask images hashes
+    """
+    for column, hash_column in IMAGE_COLUMNS:
+        filled, last_id = 0, 0
+        while True:
+            rows = get_images_after(column, hash_column, after_id=last_id, limit=chunk_size, missing_hash=True)
+            if not rows:
+                break
+            last_id = rows[-1].id
+            bulk_update_rows(column.class_, [{"id": row.id, hash_column.key: image_hash(row.image)} for row in rows])
+            filled += len(rows)
+        click.echo(f"{column.class_.__tablename__}.{column.key}: {filled} hashes filled")
+
+
+@images_cli.command("migrate")
+@click.option("--chunk-size", default=256, show_default=True, help="Rows read from the database per chunk.")
+def migrate(chunk_size):
+    """Move every stored image to the configured IMAGE_STORAGE
+    On PostgreSQL the legacy base64 text columns are first converted to bytea in place, like flask images convert (which
+    must run before deploying, the app can not use text columns). Then the rows are streamed in
+    chunks ordered by id, every image that is not in the configured storage yet (base64 text, raw bytes or a file of
+    the store) is rewritten and the missing hashes are filled, so the command can be interrupted and started again.
+    After moving the images to the filesystem run VACUUM FULL on the tables to give the space back.
+    Example: IMAGE_STORAGE=filesystem flask images migrate
+    """
+    storage = get_image_storage()
+    click.echo(f"Migrating the images to the {current_app.config['IMAGE_STORAGE']} storage")
+    for column, hash_column in IMAGE_COLUMNS:
+        name = f"{column.class_.__tablename__}.{column.key}"
+        if convert_image_column(column):
+            click.echo(f"{name} converted to bytea")
+        migrated, last_id = 0, 0
+        while True:
+            rows = get_images_after(column, hash_column, after_id=last_id, limit=chunk_size)
+            if not rows:
+                break
+            last_id = rows[-1].id
+            updates = []
+            for row in rows:
+                if not storage.is_stored(row.image):
+                    value = storage.save(storage.read(row.image))
+                    updates.append({"id": row.id, column.key: value, hash_column.key: image_hash(value)})
+                elif not row.image_hash:
+                    updates.append({"id": row.id, hash_column.key: image_hash(row.image)})
+            bulk_update_rows(column.class_, updates)
+            migrated += len(updates)
+        click.echo(f"{name}: {migrated} images updated")
+
+
+@images_cli.command("thumbnails")
+@click.option("--chunk-size", default=256, show_default=True, help="Rows read from the database per chunk.")
+@click.option("--workers", default=4, show_default=True, help="Threads resizing the images.")
+def thumbnails(chunk_size, workers):
+    """Generate the missing thumbnails (THUMBNAIL_SIZES) of the stored images
+    The rows are streamed in chunks ordered by id and the images that already have every thumbnail are skipped, so the
+    command can be interrupted and started again.
+    Example: flask images thumbnails --workers 8
+    """
+    storage = get_image_storage()
+    sizes = set(current_app.config["THUMBNAIL_SIZES"])
+
+    def resize(job):
+        source_hash, image, missing = job
+        return source_hash, make_thumbnails(storage.read(image), missing)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for column, hash_column in IMAGE_COLUMNS:
+            name = f"{column.class_.__tablename__}.{column.key}"
+            created, last_id = 0, 0
+            while True:
+                rows = get_images_after(column, hash_column, after_id=last_id, limit=chunk_size)
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                jobs = {}
+                for row in rows:
+                    jobs.setdefault(row.image_hash or image_hash(row.image), row.image)
+                stored = get_thumbnail_sizes(list(jobs))
+                jobs = [
+                    (source_hash, image, sizes - stored.get(source_hash, set()))
+                    for source_hash, image in jobs.items()
+                    if sizes - stored.get(source_hash, set())
+                ]
+                for source_hash, images in pool.map(resize, jobs):
+                    save_thumbnails(source_hash, {size: storage.save(image) for size, image in images.items()})
+                    created += len(images)
+            click.echo(f"{name}: {created} thumbnails created")
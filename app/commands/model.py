@@ -0,0 +1,117 @@
+"""This module contains the flask CLI commands to manage the ResNet model."""
+
+import json
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app.routes.resnet_model.resnet_model import DEVICE, get_model_artifact
+from app.utils.benchmark import run_benchmark
+from app.utils.inference_server import InferenceServer
+from app.utils.quantization import PRECISIONS, load_images, measure_drift, prepare_model
+from app.utils.transformation import load_model
+
+model_cli = AppGroup("model", help="Manage the ResNet model.")
+
+
+@model_cli.command("drift")
+@click.argument("images_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--precision", type=click.Choice(PRECISIONS), default="int8", help="Precision to compare against fp32.")
+@click.option("--calibration-dir", type=click.Path(exists=True, file_okay=False), default=None)
+def drift(images_dir, precision, calibration_dir):
+    """Report the accuracy drift of a reduced precision model against fp32 on a held-out set of images
+    Example: flask model drift ./holdout --calibration-dir ./calibration
+    """
+    calibration_dir = calibration_dir or current_app.config["INFERENCE_CALIBRATION_DIR"]
+    model_path = get_model_artifact().resolve()
+    reference = load_model(model_path=model_path, device_name=DEVICE).eval()
+    candidate = prepare_model(load_model(model_path=model_path, device_name=DEVICE), precision, calibration_dir)
+    report = measure_drift(reference, candidate, load_images(images_dir), device=DEVICE)
+    report["precision"] = precision
+    click.echo(json.dumps(report, indent=2))
+
+
+@model_cli.command("serve")
+@click.option("--address", default=None, help="Unix socket path or host:port, defaults to INFERENCE_SERVER_ADDRESS.")
+@click.option("--workers", default=None, type=int, help="Model processes, defaults to INFERENCE_SERVER_WORKERS.")
+@click.option("--threads", default=1, show_default=True, help="Torch threads of every model process.")
+def serve(address, workers, threads):
+    """Run the inference server, the web workers send their batches to it when INFERENCE_SERVER_ADDRESS is set
+    Example: flask model serve --address /tmp/petnet-inference.sock --workers 2 --threads 2
+    """
+    config = current_app.config
+    address = address or config["INFERENCE_SERVER_ADDRESS"]
+    if not address:
+        raise click.UsageError("An address is required, use --address or INFERENCE_SERVER_ADDRESS")
+    settings = {
+        # Resolved once here, so the weights are downloaded and verified before the model processes start
+        "model_path": get_model_artifact().resolve(),
+        "device": DEVICE,
+        "backend": config["INFERENCE_BACKEND"],
+        "precision": config["INFERENCE_PRECISION"],
+        "calibration_dir": config["INFERENCE_CALIBRATION_DIR"],
+        "check_interval": config["MODEL_CHECK_INTERVAL"],
+        "label": f"{config['INFERENCE_BACKEND']}:{config['INFERENCE_PRECISION']}",
+        "threads": threads,
+    }
+    server = InferenceServer(
+        address,
+        config["SECRET_KEY"].encode("utf-8"),
+        workers or config["INFERENCE_SERVER_WORKERS"],
+        settings,
+        timeout=config["INFERENCE_SERVER_TIMEOUT"],
+    )
+    click.echo(f"Inference server listening on {address}")
+    server.serve_forever()
+
+
+@click.command("benchmark")
+@click.option(
+    "--model-path",
+    envvar="MODEL_PATH",
+    default="./model_petnet_50_new.pth",
+    show_default=True,
+    help="Weights to time, defaults to MODEL_PATH.",
+)
+@click.option("--batch-sizes", default="1,8,32", show_default=True, help="Batch sizes of get_prediction.")
+@click.option("--threads", default="1", show_default=True, help="Comma separated torch thread counts.")
+@click.option("--iterations", default=20, show_default=True, help="Timed calls of every stage.")
+@click.option("--warmup", default=3, show_default=True, help="Untimed calls before every stage.")
+@click.option("--image-size", default="1024x768", show_default=True, help="WIDTHxHEIGHT of the synthetic images.")
+@click.option("--seed", default=0, show_default=True, help="Seed of the synthetic images and random weights.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Write the results as JSON to this file.")
+def benchmark(model_path, batch_sizes, threads, iterations, warmup, image_size, seed, output):
+    """Measure the latency (p50/p95) and throughput of every stage of the image path on synthetic images
+    The weights in MODEL_PATH are used when present, otherwise random weights, so it also runs offline. It does not use
+    the app, so it also runs without a database: python benchmark.py --threads 1,4
+    Example: flask model benchmark --batch-sizes 1,16 --threads 1,4 --output bench.json
+    """
+    try:
+        batch_sizes = tuple(int(size) for size in batch_sizes.split(","))
+        threads = tuple(int(count) for count in threads.split(","))
+        width, height = (int(value) for value in image_size.lower().split("x"))
+    except ValueError:
+        raise click.UsageError("--batch-sizes and --threads must be lists of integers and --image-size WIDTHxHEIGHT")
+    report = run_benchmark(
+        model_path=model_path,
+        batch_sizes=batch_sizes,
+        threads=threads,
+        iterations=iterations,
+        warmup=warmup,
+        image_size=(width, height),
+        device=DEVICE,
+        seed=seed,
+    )
+    click.echo(f"Weights: {report['settings']['weights']}, torch {report['environment']['torch']}")
+    click.echo(f"{'stage':<28}{'threads':>8}{'batch':>7}{'p50 ms':>11}{'p95 ms':>11}{'img/s':>10}")
+    for row in report["results"]:
+        click.echo(
+            f"{row['stage']:<28}{row['threads']:>8}{row['batch_size']:>7}"
+            f"{row['p50_ms']:>11.2f}{row['p95_ms']:>11.2f}{row['images_per_second']:>10.2f}"
+        )
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+
+model_cli.add_command(benchmark)
@@ -0,0 +1,44 @@
+"""This module contains the flask CLI commands to manage the owners and patients of the vets."""
+
+import json
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app.models import get_user_by_username
+from app.utils.importer import get_file_format, import_records, read_records
+
+owners_cli = AppGroup("owners", help="Manage the owners and patients of the vets.")
+
+
+@owners_cli.command("import")
+@click.argument("file", type=click.File("rb"))
+@click.option("--username", required=True, help="Username of the vet the owners and patients are imported for.")
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), help="Format, by default the extension.")
+@click.option("--chunk-size", type=int, help="Records per transaction, IMPORT_CHUNK_SIZE by default.")
+@click.option("--report", type=click.File("w"), help="Write the full report (with the errors) as json to this file.")
+def import_owners(file, username, file_format, chunk_size, report):
+    """Import owners and their patients from a CSV or JSONL file, see app.utils.importer for the columns
+    The file is streamed, the invalid records are skipped and reported by line.
+    Example: flask owners import clinic.csv --username vet --report report.json
+    """
+    user = get_user_by_username(username)
+    if not user:
+        raise click.BadParameter(f"User {username} not found", param_hint="--username")
+    file_format = get_file_format(file.name, file_format)
+    if not file_format:
+        raise click.BadParameter("Unknown format, use --format csv or jsonl", param_hint="--format")
+    start = time.perf_counter()
+    result = import_records(
+        read_records(file, file_format), user.id, chunk_size or current_app.config["IMPORT_CHUNK_SIZE"]
+    )
+    for error in result["errors"][:20]:
+        click.echo(f"Line {error['line']}: {', '.join(error['errors'])}", err=True)
+    if len(result["errors"]) > 20:
+        click.echo(f"... and {len(result['errors']) - 20} more errors", err=True)
+    if report:
+        json.dump(result, report, indent=2)
+    click.echo(
+        f"{result['records']} records read in {time.perf_counter() - start:.1f}s: {result['owners']} owners and "
+        f"{result['patients']} patients created, {result['failed']} records failed"
+    )
@@ -0,0 +1,65 @@
+"""This module contains the flask CLI commands to maintain the photos of the patients."""
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import click
+from flask.cli import AppGroup
+from PIL import Image
+from app.models import bulk_update_photos, get_photos_to_rescore
+from app.routes.resnet_model.resnet_model import get_model_version, predict_images
+from app.utils.image_storage import ImageStorage, get_image_storage
+from app.utils.transformation import prepare_image
+
+photos_cli = AppGroup("photos", help="Maintain the photos of the patients.")
+
+
+def decode_photo(storage: ImageStorage, photo):
+    """Decode a stored photo and prepare it for the model, the exception is returned if it can not be decoded"""
+    try:
+        return prepare_image(Image.open(io.BytesIO(storage.read(photo))))
+    except Exception as e:
+        return e
+
+
+@photos_cli.command("rescore")
+@click.option("--chunk-size", default=256, show_default=True, help="Photos read from the database per chunk.")
+@click.option("--workers", default=4, show_default=True, help="Threads decoding the photos.")
+def rescore(chunk_size, workers):
+    """Predict again the photos whose prediction was made by another version of the model
+    The photo table is streamed in chunks ordered by id, so only one chunk of images is in memory at a time. Photos
+    already scored by the current model are skipped, an interrupted run can simply be started again.
+    Example: flask photos rescore --chunk-size 512 --workers 8
+    """
+    model_version = get_model_version()
+    storage = get_image_storage()
+    click.echo(f"Rescoring photos with model {model_version}")
+    rescored, failed, last_id = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = get_photos_to_rescore(model_version, after_id=last_id, limit=chunk_size)
+            if not rows:
+                break
+            last_id = rows[-1].id
+            images = list(pool.map(partial(decode_photo, storage), [row.photo for row in rows]))
+            updates = []
+            for row, prediction in zip(rows, predict_images(images)):
+                if isinstance(prediction, Exception):
+                    failed += 1
+                    click.echo(f"Photo {row.id} could not be scored: {prediction}", err=True)
+                    continue
+                probability, predicted_class = prediction
+                updates.append(
+                    {
+                        "id": row.id,
+                        "predicted_class": predicted_class,
+                        "probability": str(probability),
+                        "model_version": model_version,
+                        "analysis_status": "done",
+                        "analysis_error": None,
+                    }
+                )
+            bulk_update_photos(updates)
+            rescored += len(updates)
+            click.echo(f"{rescored} photos rescored (last id {last_id})")
+    click.echo(f"Done, {rescored} photos rescored and {failed} failed")
@@ -2,6 +2,12 @@
 
 from .auth.auth_model import User, db
 from .patient.patient_model import Patient, Photo, Owner
+from .resnet.prediction_model import Prediction
+from .images.thumbnail_model import Thumbnail
+from .serialization import *
+from .unit_of_work import commit_session, rollback_session, savepoint, unit_of_work
 from .auth.db_queries import *
 from .user.db_queries import *
 from .patient.db_queries import *
+from .resnet.db_queries import *
+from .images.db_queries import *
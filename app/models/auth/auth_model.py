@@ -8,6 +8,7 @@ from flask import url_for
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer
+from app.utils.image_storage import image_hash
 
 
 db = SQLAlchemy()
@@ -22,7 +23,9 @@ class User(db.Model):
     """User class to store user information"""
 
     id = db.Column(db.Integer, primary_key=True)
-    profile_picture = db.Column(db.Text, nullable=True)
+    # Deferred: only loaded when accessed, the queries of the user never read the image, see app.utils.image_storage
+    profile_picture = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    profile_picture_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the profile picture, used as ETag
     first_name = db.Column(db.String(80), nullable=False)
     last_name = db.Column(db.String(80), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -46,6 +49,12 @@ class User(db.Model):
         self.username = kwargs.get("username")
         self.password = generate_password_hash(kwargs.get("password"))
 
+    @db.validates("profile_picture")
+    def validate_profile_picture(self, _, value):
+        """Keep the hash of the profile picture up to date"""
+        self.profile_picture_hash = image_hash(value)
+        return value
+
     def __repr__(self) -> str:
         return f"<User {self.username}>"
 
@@ -124,7 +133,9 @@ class User(db.Model):
         return {
             "user_id": self.id,
             "profile_picture": (
-                url_for("user.serve_profile_picture", user_id=self.id, _external=True) if self.profile_picture else None
+                url_for("user.serve_profile_picture", user_id=self.id, v=self.profile_picture_hash, _external=True)
+                if self.profile_picture_hash
+                else None
             ),
             "first_name": self.first_name,
             "last_name": self.last_name,
@@ -1,16 +1,18 @@
 """This module contains database queries for the authentication model"""
 
 from app.models.auth.auth_model import User, db
+from app.models.unit_of_work import commit_session, rollback_session
+from app.models.serialization import USER_JSON_OPTIONS
 
 
 def db_commit_and_save(obj):
     """Commit and save an object to the database"""
     try:
         db.session.add(obj)
-        db.session.commit()
+        commit_session()
         return obj
     except Exception as e:
-        db.session.rollback()
+        rollback_session()
         raise e
 
 
@@ -45,8 +47,9 @@ def get_user_by_email(email: str) -> User:
 
 
 def get_user_information(user: User) -> dict:
-    """Get the user information"""
+    """Get the user information, the user is loaded again with its patients and their photos in three queries"""
     try:
+        user = User.query.options(*USER_JSON_OPTIONS).populate_existing().filter_by(id=user.id).first()
         return User.get_json_information(user)
     except Exception as e:
         raise e
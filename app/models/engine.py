@@ -0,0 +1,14 @@
+"""This module contains the settings applied to the connections of the database engine."""
+
+from sqlalchemy import event
+
+
+def set_statement_timeout_per_transaction(engine, timeout_ms: int) -> None:
+    """Set the statement timeout at the start of every transaction (SET LOCAL, reset at its end)
+    Used in the transaction pooling mode: the connection belongs to the app only for the transaction, a session setting
+    would leak to the other clients of PgBouncer.
+    """
+
+    @event.listens_for(engine, "begin")
+    def set_statement_timeout(connection):
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
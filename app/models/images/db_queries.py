@@ -0,0 +1,146 @@
+"""This module contains the database queries of the image columns of the models and their thumbnails."""
+
+from sqlalchemy import inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+from app.models.auth.auth_model import db, User
+from app.models.images.thumbnail_model import Thumbnail
+from app.models.patient.patient_model import Patient, Photo
+from app.models.unit_of_work import commit_session, rollback_session
+
+# Every column holding an image with the column of its hash, see app.utils.image_storage
+IMAGE_COLUMNS = [
+    (User.profile_picture, User.profile_picture_hash),
+    (Patient.profile_photo, Patient.profile_photo_hash),
+    (Photo.photo, Photo.photo_hash),
+]
+
+
+def get_text_image_columns() -> list:
+    """Get the image columns that are still legacy base64 text in the database (PostgreSQL only, the other databases
+    store any value in any column). The models map them to bytea, so they must be converted before the app uses them.
+    """
+    try:
+        if db.engine.dialect.name != "postgresql":
+            return []
+        inspector = inspect(db.engine)
+        columns = []
+        for column, _ in IMAGE_COLUMNS:
+            table = column.class_.__table__
+            types = {info["name"]: info["type"] for info in inspector.get_columns(table.name)}
+            if column.key in types and not isinstance(types[column.key], db.LargeBinary):
+                columns.append(column)
+        return columns
+    except Exception as e:
+        raise e
+
+
+def convert_image_column(column) -> bool:
+    """Change the type of a legacy base64 text column to bytea decoding its values in place, return True if it was
+    converted. Only PostgreSQL is converted, the other databases keep the column and its rows are migrated one by one.
+    """
+    try:
+        if not any(text_column is column for text_column in get_text_image_columns()):
+            return False
+        table = column.class_.__table__
+        preparer = db.engine.dialect.identifier_preparer
+        table_name, column_name = preparer.quote(table.name), preparer.quote(column.key)
+        db.session.execute(
+            text(
+                f"ALTER TABLE {table_name} ALTER COLUMN {column_name} TYPE bytea "
+                f"USING decode({column_name}, 'base64')"
+            )
+        )
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def get_image_info(column, hash_column, row_id: int):
+    """Get the (id, image_hash, has_image) of a row without reading its image, or None if the row does not exist"""
+    try:
+        model = column.class_
+        query = select(
+            model.id, hash_column.label("image_hash"), column.isnot(None).label("has_image")
+        ).where(model.id == row_id)
+        return db.session.execute(query).first()
+    except Exception as e:
+        raise e
+
+
+def get_image(column, row_id: int):
+    """Get the value of the image column of a row"""
+    try:
+        return db.session.execute(select(column).where(column.class_.id == row_id)).scalar()
+    except Exception as e:
+        raise e
+
+
+def get_images_after(column, hash_column, after_id: int = 0, limit: int = 256, missing_hash: bool = False) -> list:
+    """Get the (id, image, image_hash) of the next rows with an image in the column, ordered by id
+    missing_hash only gets the rows whose hash is not filled yet.
+    """
+    try:
+        model = column.class_
+        query = (
+            select(model.id, column.label("image"), hash_column.label("image_hash"))
+            .where(model.id > after_id, column.isnot(None))
+            .order_by(model.id)
+            .limit(limit)
+        )
+        if missing_hash:
+            query = query.where(hash_column.is_(None))
+        return db.session.execute(query).all()
+    except Exception as e:
+        raise e
+
+
+def bulk_update_rows(model, rows: list) -> None:
+    """Update several rows of a model in one statement, every row is a dict with the id and the new values"""
+    try:
+        if rows:
+            db.session.execute(update(model), rows)
+        commit_session()
+    except Exception as e:
+        rollback_session()
+        raise e
+
+
+def get_thumbnail_info(source_hash: str, size: int):
+    """Get the (id, image_hash) of the thumbnail of an image at a size without reading it, or None"""
+    try:
+        query = select(Thumbnail.id, Thumbnail.image_hash).where(
+            Thumbnail.source_hash == source_hash, Thumbnail.size == size
+        )
+        return db.session.execute(query).first()
+    except Exception as e:
+        raise e
+
+
+def get_thumbnail_sizes(source_hashes: list) -> dict:
+    """Get the sizes of the thumbnails already stored for every image hash"""
+    try:
+        query = select(Thumbnail.source_hash, Thumbnail.size).where(Thumbnail.source_hash.in_(source_hashes))
+        sizes = {}
+        for source_hash, size in db.session.execute(query):
+            sizes.setdefault(source_hash, set()).add(size)
+        return sizes
+    except Exception as e:
+        raise e
+
+
+def save_thumbnails(source_hash: str, images: dict) -> None:
+    """Store the thumbnails of an image ({size: image}), ignoring the ones another worker already stored"""
+    for size, image in images.items():
+        try:
+            # A savepoint keeps a duplicate insert from rolling back the other thumbnails
+            with db.session.begin_nested():
+                db.session.add(Thumbnail(source_hash=source_hash, size=size, image=image))
+        except IntegrityError:
+            pass
+    try:
+        commit_session()
+    except Exception as e:
+        rollback_session()
+        raise e
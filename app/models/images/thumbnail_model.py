@@ -0,0 +1,31 @@
+"""This module contains the Thumbnail class which is used to store the reduced size derivatives of the images"""
+
+from app.models.auth.auth_model import db
+from app.utils.image_storage import image_hash
+
+
+class Thumbnail(db.Model):
+    """Thumbnail class to store a derivative of an image at a size
+    The source image is identified by its hash, so the photos sharing an image share their thumbnails. image is stored
+    like the other image columns, see app.utils.image_storage.
+    """
+
+    __table_args__ = (db.UniqueConstraint("source_hash", "size", name="uq_thumbnail_source_size"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_hash = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # pixels of the longest side
+    image = db.Column(db.LargeBinary, nullable=False)
+    image_hash = db.Column(db.String(64), nullable=False)
+
+    def __init__(self, **kwargs) -> None:
+        """Initialize the thumbnail object"""
+        self.source_hash = kwargs.get("source_hash")
+        self.size = kwargs.get("size")
+        self.image = kwargs.get("image")
+
+    @db.validates("image")
+    def validate_image(self, _, value):
+        """Keep the hash of the image up to date"""
+        self.image_hash = image_hash(value)
+        return value
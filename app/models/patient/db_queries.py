@@ -1,18 +1,22 @@
 """This module contains the database queries for the patient model."""
 
-from sqlalchemy import or_
+from flask import current_app
+from sqlalchemy import Float, and_, case, cast, func, insert, or_, select, update
+from sqlalchemy.orm import undefer
 from app.models.auth.auth_model import db, User
 from app.models.patient.patient_model import Owner, Patient, Photo
+from app.models.unit_of_work import commit_session, rollback_session
+from app.utils.pagination import Page
 
 
 def db_commit_and_save(obj):
     """Commit and save an object to the database"""
     try:
         db.session.add(obj)
-        db.session.commit()
+        commit_session()
         return obj
     except Exception as e:
-        db.session.rollback()
+        rollback_session()
         raise e
 
 
@@ -25,10 +29,10 @@ def create_new_patient(data: dict) -> Patient:
         raise e
 
 
-def get_patient_by_id(patient_id: int) -> Patient:
-    """Get a patient by id"""
+def get_patient_by_id(patient_id: int, *options) -> Patient:
+    """Get a patient by id, options are the loader options of the query (see app.models.serialization)"""
     try:
-        return Patient.query.filter_by(id=patient_id).first()
+        return Patient.query.options(*options).filter_by(id=patient_id).first()
     except Exception as e:
         raise e
 
@@ -56,9 +60,9 @@ def delete_patient_information(patient: Patient) -> None:
     """Delete the patient information"""
     try:
         db.session.delete(patient)
-        db.session.commit()
+        commit_session()
     except Exception as e:
-        db.session.rollback()
+        rollback_session()
         raise e
 
 
@@ -95,9 +99,9 @@ def delete_owner_information(owner: Owner) -> None:
     """Delete the owner information"""
     try:
         db.session.delete(owner)
-        db.session.commit()
+        commit_session()
     except Exception as e:
-        db.session.rollback()
+        rollback_session()
         raise e
 
 
@@ -109,14 +113,59 @@ def get_owner_by_email(email: str) -> Owner:
         raise e
 
 
-def get_owner_by_id(owner_id: int) -> Owner:
-    """Get an owner by id"""
+def get_owner_by_id(owner_id: int, *options) -> Owner:
+    """Get an owner by id, options are the loader options of the query (see app.models.serialization)"""
     try:
-        return Owner.query.filter_by(id=owner_id).first()
+        return Owner.query.options(*options).filter_by(id=owner_id).first()
     except Exception as e:
         raise e
 
 
+def get_owners_by_emails(emails: list) -> dict:
+    """Get the owners registered with any of the emails in one query, returns {email: (owner id, user id)}"""
+    try:
+        rows = db.session.execute(select(Owner.email, Owner.id, Owner.user_id).where(Owner.email.in_(emails))).all()
+        return {email: (owner_id, user_id) for email, owner_id, user_id in rows}
+    except Exception as e:
+        raise e
+
+
+def get_registered_user_emails(emails: list) -> set:
+    """Get which of the emails are registered by users, in one query"""
+    try:
+        return set(db.session.execute(select(User.email).where(User.email.in_(emails))).scalars())
+    except Exception as e:
+        raise e
+
+
+def bulk_create_owners_and_patients(owners: list, patients: list) -> tuple:
+    """Create owners and patients in one transaction with multi-row INSERT statements, returns their number
+    The owners and patients are dicts of their columns, a patient references its owner by owner_id or, for the owners
+    created in the same call, by their email (owner_email).
+    """
+    try:
+        owner_ids = {}
+        if owners:
+            rows = db.session.execute(
+                insert(Owner).returning(Owner.id, Owner.email, sort_by_parameter_order=True), owners
+            )
+            owner_ids = {email: owner_id for owner_id, email in rows}
+        patients = [
+            {
+                **{key: value for key, value in patient.items() if key != "owner_email"},
+                "owner_id": patient.get("owner_id") or owner_ids[patient["owner_email"]],
+            }
+            for patient in patients
+        ]
+        if patients:
+            db.session.execute(insert(Patient), patients)
+        commit_session()
+        return len(owners), len(patients)
+    except Exception as e:
+        rollback_session()
+        raise e
+
+
 def create_new_photo(data: dict) -> Photo:
     """Create a new photo"""
     try:
@@ -134,6 +183,20 @@ def get_photo_by_id(photo_id: int) -> Photo:
         raise e
 
 
+def get_user_photo_by_id(user: User, photo_id: int, *options) -> Photo:
+    """Get a photo by id if it belongs to a patient of the user, the ownership is checked by the join of the same query
+    options are the loader options of the query, for example undefer(Photo.photo) to read the image with it"""
+    try:
+        return (
+            Photo.query.options(*options)
+            .join(Patient, Patient.id == Photo.patient_id)
+            .filter(Photo.id == photo_id, Patient.user_id == user.id)
+            .first()
+        )
+    except Exception as e:
+        raise e
+
+
 def update_photo_information(photo: Photo, data: dict) -> Photo:
     """Update the photo information"""
     try:
@@ -144,44 +207,189 @@ def update_photo_information(photo: Photo, data: dict) -> Photo:
         raise e
 
 
-def photo_belong_to_user(photo: Photo, user: User) -> bool:
-    """Check if the photo belongs to the user"""
+def get_user_photos_by_ids(user: User, photo_ids: list) -> list:
+    """Get the photos with the given ids that belong to the patients of the user, with their images to predict them"""
     try:
-        patients = (patient for patient in user.patients)
-        photos = (photo for patient in patients for photo in patient.photos)
-        photos_id = [photo.patient_id for photo in photos]
+        return (
+            Photo.query.options(undefer(Photo.photo))
+            .join(Patient)
+            .filter(Photo.id.in_(photo_ids), Patient.user_id == user.id)
+            .all()
+        )
+    except Exception as e:
+        raise e
 
-        if photo.id not in photos_id:
-            return False
-        return True
+
+def update_photos_predictions(predictions: list) -> None:
+    """Save the predictions of several photos in one transaction, predictions is a list of (photo, data) pairs"""
+    try:
+        for photo, data in predictions:
+            for key, value in data.items():
+                setattr(photo, key, value)
+        commit_session()
     except Exception as e:
+        rollback_session()
         raise e
 
 
-def search_patients_nickname(user: User, search_query: str) -> list:
-    """Search for patients"""
+def get_photos_to_rescore(model_version: str, after_id: int = 0, limit: int = 256) -> list:
+    """Get the (id, photo) of the next photos whose prediction was not made by the model version, ordered by id"""
     try:
-        if search_query == "*":
-            return [patient.get_information_json() for patient in user.patients]
+        query = (
+            select(Photo.id, Photo.photo)
+            .where(Photo.id > after_id, or_(Photo.model_version.is_(None), Photo.model_version != model_version))
+            .order_by(Photo.id)
+            .limit(limit)
+        )
+        return db.session.execute(query).all()
+    except Exception as e:
+        raise e
+
+
+def bulk_update_photos(rows: list) -> None:
+    """Update several photos in one statement, every row is a dict with the id of the photo and the new values"""
+    try:
+        if rows:
+            db.session.execute(update(Photo), rows)
+        commit_session()
+    except Exception as e:
+        rollback_session()
+        raise e
+
+
+def escape_like(value: str) -> str:
+    """Escape the wildcards of a LIKE pattern, so they are searched as plain characters"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def get_page(query, model, after: int, limit: int) -> Page:
+    """Get the rows of a query whose id is greater than after (None for the first page), ordered by id. One more row is
+    read to know if there is a next page"""
+    try:
+        if after is not None and not isinstance(after, int):
+            raise ValueError("Invalid cursor")
+        rows = query.filter(model.id > (after or 0)).order_by(model.id).limit(limit + 1).all()
+        return Page(rows[:limit], rows[limit - 1].id if len(rows) > limit else None)
+    except Exception as e:
+        raise e
+
+
+def search_score(expression, search_query: str):
+    """Relevance of the match of the search query in a text column, the higher the better
+    On PostgreSQL it is the trigram similarity (pg_trgm). The other databases (sqlite in the local setup) rank the exact
+    matches first, then the prefixes and then the other substrings.
+    The similarity is a real (float4), it is cast to double precision so the score of the cursor, a Python float,
+    compares equal to the score of its row on the next page.
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        return cast(func.similarity(expression, search_query), Float(53))
+    text, search_query = func.lower(expression), search_query.lower()
+    return case(
+        (text == search_query, 1.0), (text.like(f"{escape_like(search_query)}%", escape="\\"), 0.5), else_=0.25
+    )
+
+
+def get_ranked_page(query, model, expression, search_query: str, after: tuple, limit: int) -> Page:
+    """Get the rows of a query whose text expression contains the search query (case-insensitive), ranked by relevance
+    and then by id. after is the (score, id) of the last row of the previous page (None for the first page)"""
+    try:
+        if after is not None and not isinstance(after, tuple):
+            raise ValueError("Invalid cursor")
+        score = search_score(expression, search_query)
+        query = query.filter(expression.ilike(f"%{escape_like(search_query)}%", escape="\\"))
+        if after is not None:
+            after_score, after_id = after
+            query = query.filter(or_(score < after_score, and_(score == after_score, model.id > after_id)))
+        rows = query.add_columns(score.label("score")).order_by(score.desc(), model.id).limit(limit + 1).all()
+        after = [rows[limit - 1].score, rows[limit - 1][0].id] if len(rows) > limit else None
+        return Page([row[0] for row in rows[:limit]], after)
+    except Exception as e:
+        raise e
+
+
+def get_first_pages(model, parent_column, parent_ids: list, limit: int) -> dict:
+    """Get the first page of the children of several parents in one query, returns {parent id: Page}
+    The children are numbered by parent with a window function, only the first limit + 1 of every parent are read.
+    """
+    try:
+        if not parent_ids:
+            return {}
+        row_number = func.row_number().over(partition_by=parent_column, order_by=model.id).label("row_number")
+        numbered = select(model.id, row_number).where(parent_column.in_(parent_ids)).subquery()
+        rows = (
+            model.query.join(numbered, model.id == numbered.c.id)
+            .filter(numbered.c.row_number <= limit + 1)
+            .order_by(model.id)
+            .all()
+        )
+        children = {parent_id: [] for parent_id in parent_ids}
+        for row in rows:
+            children[getattr(row, parent_column.key)].append(row)
+        return {
+            parent_id: Page(rows[:limit], rows[limit - 1].id if len(rows) > limit else None)
+            for parent_id, rows in children.items()
+        }
+    except Exception as e:
+        raise e
+
+
+def get_patients_json(patients: list) -> list:
+    """Serialize patients with the first page of their photos, read in one query"""
+    patient_ids = [patient.id for patient in patients]
+    photos = get_first_pages(Photo, Photo.patient_id, patient_ids, current_app.config["NESTED_PAGE_SIZE"])
+    return [patient.get_information_json(photos=photos[patient.id]) for patient in patients]
+
+
+def get_owners_json(owners: list) -> list:
+    """Serialize owners with the first page of their patients and the first page of the photos of those patients, read
+    in two queries"""
+    nested_limit = current_app.config["NESTED_PAGE_SIZE"]
+    patients = get_first_pages(Patient, Patient.owner_id, [owner.id for owner in owners], nested_limit)
+    patient_ids = [patient.id for page in patients.values() for patient in page.items]
+    photos = get_first_pages(Photo, Photo.patient_id, patient_ids, nested_limit)
+    return [owner.get_information_json(patients=patients[owner.id], photos=photos) for owner in owners]
 
-        patients = [patient for patient in user.patients if search_query.lower() in patient.nickname.lower()]
-        return [patient.get_information_json() for patient in patients]
+
+def get_patient_photos(patient: Patient, after: int = None, limit: int = 50) -> Page:
+    """Get a page of the photos of a patient"""
+    try:
+        return get_page(Photo.query.filter_by(patient_id=patient.id), Photo, after, limit)
     except Exception as e:
         raise e
 
 
-def search_owners_name(user: User, search_query: str) -> list:
-    """Search for owners, the search is done by first name and last name"""
+def get_owner_patients(owner: Owner, after: int = None, limit: int = 50) -> tuple:
+    """Get a page of the patients of an owner, returns (patients json, Page)"""
     try:
+        page = get_page(Patient.query.filter_by(owner_id=owner.id), Patient, after, limit)
+        return get_patients_json(page.items), page
+    except Exception as e:
+        raise e
+
+
+def search_patients_nickname(user: User, search_query: str, after=None, limit: int = 50) -> tuple:
+    """Search for patients by nickname, a page ranked by relevance ('*' for all of them, ordered by id). Returns
+    (patients json, Page)"""
+    try:
+        query = Patient.query.filter_by(user_id=user.id)
         if search_query == "*":
-            return [owner.get_information_json() for owner in user.owners]
+            page = get_page(query, Patient, after, limit)
+        else:
+            page = get_ranked_page(query, Patient, Patient.nickname, search_query, after, limit)
+        return get_patients_json(page.items), page
+    except Exception as e:
+        raise e
 
-        owners = [
-            owner
-            for owner in user.owners
-            if search_query.lower() in owner.first_name.lower() or search_query.lower() in owner.last_name.lower()
-        ]
 
-        return [owner.get_information_json() for owner in owners]
+def search_owners_name(user: User, search_query: str, after=None, limit: int = 50) -> tuple:
+    """Search for owners by full name (first name and last name), a page ranked by relevance ('*' for all of them,
+    ordered by id). Returns (owners json, Page)"""
+    try:
+        query = Owner.query.filter_by(user_id=user.id)
+        if search_query == "*":
+            page = get_page(query, Owner, after, limit)
+        else:
+            page = get_ranked_page(query, Owner, Owner.full_name, search_query, after, limit)
+        return get_owners_json(page.items), page
     except Exception as e:
         raise e
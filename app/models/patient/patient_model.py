@@ -1,9 +1,13 @@
 """Patient class to store patient information."""
 
 from datetime import datetime
-from flask import url_for
+from flask import current_app, url_for
 from pytz import timezone
+from sqlalchemy import DDL, event, literal_column
+from sqlalchemy.ext.hybrid import hybrid_property
 from app.models.auth.auth_model import db
+from app.utils.image_storage import image_hash
+from app.utils.pagination import Page
 
 local_tz = timezone("Etc/GMT+5")
 
@@ -19,10 +23,23 @@ class Patient(db.Model):
     age = db.Column(db.Integer, nullable=False)
     date_of_register = db.Column(db.DateTime, nullable=False, default=datetime.now(local_tz))
     weight = db.Column(db.Float, nullable=False)
-    profile_photo = db.Column(db.Text, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)  # this is the id of the veteriniarian
-    owner_id = db.Column(db.Integer, db.ForeignKey("owner.id"), nullable=False)  # this is the id of the pet owner
+    # Deferred: only loaded when accessed, the queries of the patient never read the image, see app.utils.image_storage
+    profile_photo = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    profile_photo_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the profile photo, used as ETag
+    # Indexed: the patients are always filtered by their vet or owner
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.id"), nullable=False, index=True
+    )  # this is the id of the veteriniarian
+    owner_id = db.Column(
+        db.Integer, db.ForeignKey("owner.id"), nullable=False, index=True
+    )  # this is the id of the pet owner
     photos = db.relationship("Photo", backref="patient", lazy=True, cascade="all, delete-orphan")
+    # Trigram index of the search by nickname (pg_trgm), it serves the case-insensitive substring matches (ILIKE)
+    __table_args__ = (
+        db.Index(
+            "ix_patient_nickname_trgm", "nickname", postgresql_using="gin", postgresql_ops={"nickname": "gin_trgm_ops"}
+        ),
+    )
 
     def __init__(self, **kwargs) -> None:
         self.nickname = kwargs.get("nickname")
@@ -32,23 +49,54 @@ class Patient(db.Model):
         self.owner_id = kwargs.get("owner_id")
         self.profile_photo = kwargs.get("profile_photo")
 
-    def get_information_json(self) -> dict:
-        """Return the information of the patient in json format"""
-        return {
+    @db.validates("profile_photo")
+    def validate_profile_photo(self, _, value):
+        """Keep the hash of the profile photo up to date"""
+        self.profile_photo_hash = image_hash(value)
+        return value
+
+    def get_information_json(self, photos: Page = None) -> dict:
+        """Return the information of the patient in json format
+        photos is a page of the photos of the patient (all of them by default), the URL of the next one is photos_next.
+        """
+        information = {
             "id": self.id,
             "nickname": self.nickname,
             "age": self.age,
             "date_of_register": self.date_of_register.strftime("%Y-%m-%d %H:%M:%S") if self.date_of_register else None,
             "weight": self.weight,
             "profile_photo": (
-                url_for("patient.serve_profile_photo", patient_id=self.id, _external=True)
-                if self.profile_photo
+                url_for("patient.serve_profile_photo", patient_id=self.id, v=self.profile_photo_hash, _external=True)
+                if self.profile_photo_hash
+                else None
+            ),
+            "profile_photo_thumbnails": (
+                {
+                    str(size): url_for(
+                        "patient.serve_profile_photo",
+                        patient_id=self.id,
+                        size=size,
+                        v=self.profile_photo_hash,
+                        _external=True,
+                    )
+                    for size in current_app.config["THUMBNAIL_SIZES"]
+                }
+                if self.profile_photo_hash
                 else None
             ),
             "user_id": self.user_id,
             "owner_id": self.owner_id,
-            "photos": [photo.get_information_json() for photo in self.photos],
+            "photos": [photo.get_information_json() for photo in (self.photos if photos is None else photos.items)],
         }
+        if photos is not None:
+            information["photos_next"] = (
+                url_for(
+                    "patient.get_patient_photos_page", patient_id=self.id, cursor=photos.next_cursor, _external=True
+                )
+                if photos.next_cursor
+                else None
+            )
+        return information
 
 
 class Photo(db.Model):
@@ -57,13 +105,21 @@ class Photo(db.Model):
     """
 
     id = db.Column(db.Integer, primary_key=True)
-    photo = db.Column(db.Text, nullable=False)
+    # Deferred: only loaded when accessed, the queries of the photo never read the image, see app.utils.image_storage
+    photo = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    photo_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the photo, used as ETag
     filename = db.Column(db.String(100), nullable=False)
     date_of_register = db.Column(db.DateTime, nullable=False, default=datetime.now(local_tz))
-    patient_id = db.Column(db.Integer, db.ForeignKey("patient.id"), nullable=False)  # this is the id of the pet
+    # Indexed: the photos are always read by patient
+    patient_id = db.Column(
+        db.Integer, db.ForeignKey("patient.id"), nullable=False, index=True
+    )  # this is the id of the pet
     description = db.Column(db.String(255), nullable=True)
     probability = db.Column(db.String(25), nullable=True)
     predicted_class = db.Column(db.String(100), nullable=True)
+    model_version = db.Column(db.String(100), nullable=True)  # version of the model that made the prediction
+    analysis_status = db.Column(db.String(20), nullable=True)  # pending, done or failed
+    analysis_error = db.Column(db.String(255), nullable=True)
 
     def __init__(self, **kwargs) -> None:
         """Initialize the photo object"""
@@ -76,18 +132,42 @@ class Photo(db.Model):
         # If probability and predicted_class are not provided, set them to None
         self.probability = kwargs.get("probability", None)
         self.predicted_class = kwargs.get("predicted_class", None)
+        self.model_version = kwargs.get("model_version", None)
+        self.analysis_status = kwargs.get("analysis_status", None)
+
+    @db.validates("photo")
+    def validate_photo(self, _, value):
+        """Keep the hash of the photo up to date"""
+        self.photo_hash = image_hash(value)
+        return value
 
     def get_information_json(self) -> dict:
         """Return the information of the photo in json format"""
         return {
             "id": self.id,
-            "photo": url_for("patient.serve_photo", photo_id=self.id, _external=True),
+            "photo": url_for("patient.serve_photo", photo_id=self.id, v=self.photo_hash, _external=True),
+            "thumbnails": {
+                str(size): url_for("patient.serve_photo", photo_id=self.id, size=size, v=self.photo_hash, _external=True)
+                for size in current_app.config["THUMBNAIL_SIZES"]
+            },
             "filename": self.filename,
             "date_of_register": self.date_of_register.strftime("%Y-%m-%d %H:%M:%S") if self.date_of_register else None,
             "patient_id": self.patient_id,
             "description": self.description,
             "probability": self.probability,
             "predicted_class": self.predicted_class,
+            "analysis_status": self.analysis_status,
+        }
+
+    def get_analysis_json(self) -> dict:
+        """Return the status of the analysis of the photo in json format"""
+        return {
+            "job_id": self.id,
+            "photo_id": self.id,
+            "status": self.analysis_status,
+            "probability": self.probability,
+            "predicted_class": self.predicted_class,
+            "error": self.analysis_error,
         }
 
 
@@ -100,7 +180,9 @@ class Owner(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     phone_number = db.Column(db.String(120), nullable=False)
     document = db.Column(db.String(20), nullable=False)  # dni - ruc - passport
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)  # this is the id of the veterinarian
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.id"), nullable=False, index=True
+    )  # this is the id of the veterinarian
     patients = db.relationship(
         "Patient", backref="owner", lazy=True, cascade="all, delete-orphan"
     )  # this is the information of the pets he owns.
@@ -114,17 +196,41 @@ class Owner(db.Model):
         self.document = kwargs.get("document")
         self.user_id = kwargs.get("user_id")
 
-    def get_information_json(self) -> dict:
-        """Return the information of the owner in json format"""
-        return {
+    def get_information_json(self, patients: Page = None, photos: dict = None) -> dict:
+        """Return the information of the owner in json format
+        patients is a page of the patients of the owner (all of them by default), the URL of the next one is
+        patients_next. photos maps the id of those patients to the page of their photos.
+        """
+        information = {
             "id": self.id,
             "first_name": self.first_name,
             "last_name": self.last_name,
             "email": self.email,
             "phone_number": self.phone_number,
             "document": self.document,
-            "patients": [patient.get_information_json() for patient in self.patients],
         }
+        if patients is None:
+            information["patients"] = [patient.get_information_json() for patient in self.patients]
+            return information
+        information["patients"] = [
+            patient.get_information_json(photos=(photos or {}).get(patient.id)) for patient in patients.items
+        ]
+        information["patients_next"] = (
+            url_for("owner.get_owner_patients_page", owner_id=self.id, cursor=patients.next_cursor, _external=True)
+            if patients.next_cursor
+            else None
+        )
+        return information
+
+    @hybrid_property
+    def full_name(self) -> str:
+        """First name and last name of the owner, the owners are searched by it"""
+        return f"{self.first_name} {self.last_name}"
+
+    @full_name.expression
+    def full_name(cls):
+        """SQL expression of the full name, it must match the expression of its trigram index to use it"""
+        return cls.first_name + literal_column("' '") + cls.last_name
 
     def get_json_pdf(self) -> dict:
         """Return the information of the owner in json format"""
@@ -138,3 +244,17 @@ class Owner(db.Model):
     def get_email(self) -> str:
         """Return the email of the owner"""
         return self.email
+
+
+# Trigram index of the search of the owners by full name
+db.Index(
+    "ix_owner_full_name_trgm",
+    Owner.full_name.label("full_name"),
+    postgresql_using="gin",
+    postgresql_ops={"full_name": "gin_trgm_ops"},
+)
+# The trigram indexes require the pg_trgm extension, created before the tables (see flask database indexes for the
+# databases created before)
+event.listen(
+    db.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
@@ -0,0 +1,32 @@
+"""This module contains the database queries for the prediction model."""
+
+from sqlalchemy.exc import IntegrityError
+from app.models.auth.auth_model import db
+from app.models.resnet.prediction_model import Prediction
+from app.models.unit_of_work import commit_session, rollback_session
+
+
+def get_stored_prediction(image_hash: str, model_version: str) -> Prediction:
+    """Get the stored prediction of an image for a model version"""
+    try:
+        return Prediction.query.filter_by(image_hash=image_hash, model_version=model_version).first()
+    except Exception as e:
+        raise e
+
+
+def save_prediction(image_hash: str, model_version: str, probability: float, predicted_class: str) -> None:
+    """Store the prediction of an image, ignoring it if another worker already stored it"""
+    prediction = Prediction(
+        image_hash=image_hash, model_version=model_version, probability=probability, predicted_class=predicted_class
+    )
+    try:
+        # A savepoint keeps a duplicate insert from rolling back the rest of the session
+        with db.session.begin_nested():
+            db.session.add(prediction)
+    except IntegrityError:
+        pass
+    try:
+        commit_session()
+    except Exception as e:
+        rollback_session()
+        raise e
@@ -0,0 +1,34 @@
+"""This module contains the Prediction class which is used to persist the predictions of the ResNet model"""
+
+from datetime import datetime
+from pytz import timezone
+from app.models.auth.auth_model import db
+
+local_tz = timezone("Etc/GMT+5")
+
+
+class Prediction(db.Model):
+    """Prediction class to store the result of the model for an image
+    The image is identified by the hash of its pixels, so the same photo uploaded twice shares the prediction,
+    and model_version keeps the predictions of different weights apart.
+    """
+
+    __table_args__ = (db.UniqueConstraint("image_hash", "model_version", name="uq_prediction_image_model"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    image_hash = db.Column(db.String(64), nullable=False)
+    model_version = db.Column(db.String(100), nullable=False)
+    probability = db.Column(db.Float, nullable=False)
+    predicted_class = db.Column(db.String(100), nullable=False)
+    date_of_register = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(local_tz))
+
+    def __init__(self, **kwargs) -> None:
+        """Initialize the prediction object"""
+        self.image_hash = kwargs.get("image_hash")
+        self.model_version = kwargs.get("model_version")
+        self.probability = kwargs.get("probability")
+        self.predicted_class = kwargs.get("predicted_class")
+
+    def get_result(self) -> tuple:
+        """Return the prediction as (probability, predicted_class)"""
+        return self.probability, self.predicted_class
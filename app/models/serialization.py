@@ -0,0 +1,12 @@
+"""This module contains the loading strategy of the queries whose results are serialized to json. The serializers
+(get_json_information and get_information_json) walk the patients of the users and owners and the photos of the
+patients, these options load every level up front with one SELECT ... IN query, so the number of statements of an
+endpoint does not depend on the number of patients or photos."""
+
+from sqlalchemy.orm import selectinload
+from app.models.auth.auth_model import User
+from app.models.patient.patient_model import Owner, Patient
+
+PATIENT_JSON_OPTIONS = (selectinload(Patient.photos),)
+OWNER_JSON_OPTIONS = (selectinload(Owner.patients).selectinload(Patient.photos),)
+USER_JSON_OPTIONS = (selectinload(User.patients).selectinload(Patient.photos),)
@@ -0,0 +1,56 @@
+"""This module contains the unit of work of the requests that write several rows. Inside unit_of_work() the query
+helpers (db_commit_and_save and the other ones that commit) only flush their changes, so the generated ids are
+available, and the block commits them all at once at its end or rolls them all back if it raises. A request then costs
+one commit instead of one per row, and a failure halfway does not leave orphan rows."""
+
+from contextlib import contextmanager
+from app.models.auth.auth_model import db
+
+
+def commit_session() -> None:
+    """Commit the session, or only flush it inside a unit of work (the unit commits at its end)"""
+    if db.session.info.get("unit_of_work"):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def rollback_session() -> None:
+    """Roll back the session after a failed write, except inside a unit of work: the changes already flushed by the
+    unit must not be discarded behind its back, the error reaches the unit and it rolls back everything"""
+    if not db.session.info.get("unit_of_work"):
+        db.session.rollback()
+
+
+@contextmanager
+def savepoint():
+    """Inside a unit of work run the block in a savepoint, so an error caught by the caller only discards the changes
+    of the block and the unit goes on. Outside a unit the block runs as is, its helpers commit on their own."""
+    if db.session.info.get("unit_of_work"):
+        with db.session.begin_nested():
+            yield
+    else:
+        yield
+
+
+@contextmanager
+def unit_of_work():
+    """Commit once, at the end of the block, the changes of the query helpers called inside, or roll them back if it
+    raises. A unit inside another one is part of the outer one, only the outermost commits.
+    Example:
+        with unit_of_work():
+            owner = create_new_owner(owner_data)
+            create_new_patient({**patient_data, "owner_id": owner.id})
+    """
+    info = db.session.info
+    info["unit_of_work"] = info.get("unit_of_work", 0) + 1
+    try:
+        yield db.session
+        if info["unit_of_work"] == 1:
+            db.session.commit()
+    except Exception:
+        if info["unit_of_work"] == 1:
+            db.session.rollback()
+        raise
+    finally:
+        info["unit_of_work"] -= 1
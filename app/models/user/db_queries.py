@@ -2,16 +2,17 @@
 
 from werkzeug.security import generate_password_hash
 from app.models.auth.auth_model import User, db
+from app.models.unit_of_work import commit_session, rollback_session
 
 
 def db_commit_and_save(obj):
     """Commit and save an object to the database"""
     try:
         db.session.add(obj)
-        db.session.commit()
+        commit_session()
         return obj
     except Exception as e:
-        db.session.rollback()
+        rollback_session()
         raise e
 
 
@@ -37,8 +38,8 @@ def delete_user(user: User) -> None:
     """Delete a user"""
     try:
         db.session.delete(user)
-        db.session.commit()
+        commit_session()
         return None
     except Exception as e:
-        db.session.rollback()
+        rollback_session()
         raise e
@@ -12,6 +12,7 @@ from app.models import (
     db_commit_and_save,
     get_user_information,
     get_user_by_email,
+    unit_of_work,
 )
 from app.utils.utils import (
     text_is_valid,
@@ -108,13 +109,14 @@ def confirm_email(token):
     user_id, new_mail = User.confirm_token(token)
     if user_id:
         try:
-            user = get_user_by_id(user_id)
-            user.confirmed = True
-            message = "Email confirmed successfully"
-            if new_mail:
-                user.email = new_mail
-                message = "Email updated successfully"
-            _ = db_commit_and_save(user)
+            with unit_of_work():
+                user = get_user_by_id(user_id)
+                user.confirmed = True
+                message = "Email confirmed successfully"
+                if new_mail:
+                    user.email = new_mail
+                    message = "Email updated successfully"
+                _ = db_commit_and_save(user)
             with open("app/templates/html/confirmation_success.html", "r", encoding="utf-8") as f:
                 html_template = f.read()
             return render_template_string(html_template, message=message)
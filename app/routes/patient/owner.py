@@ -1,16 +1,21 @@
 """This module is responsible for handling the routes for the owner of the pet."""
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from app.decorators.decorators import token_required
 from app.models import (
+    OWNER_JSON_OPTIONS,
     create_new_owner,
     get_user_by_email,
     get_owner_by_email,
     update_owner_info,
     get_owner_by_id,
+    get_owner_patients,
     delete_owner_information,
     search_owners_name,
+    unit_of_work,
 )
+from app.utils.importer import get_file_format, import_records, read_records
+from app.utils.pagination import get_page_args, page_response
 from app.utils.utils import email_is_valid, text_is_valid, validate_input, phone_number_is_valid
 
 owner = Blueprint("owner", __name__)
@@ -77,6 +82,31 @@ def register_owner(current_user):
         return jsonify({"message": "There was an error registering an owner", "error": str(e)}), 400
 
 
+@owner.route("/import", methods=["POST"])
+@token_required
+def import_owners(current_user):
+    """Import owners and their patients from a CSV or JSONL file (multipart key "file"), see app.utils.importer
+    The format is taken from the extension of the file (.csv, .jsonl or .ndjson) or from the form field "format". The
+    invalid records are skipped and reported by line, the other ones are imported:
+    {
+        "records": 3, "owners": 1, "patients": 1, "failed": 1,
+        "errors": [{"line": 3, "errors": ["Invalid email"]}]
+    }
+    """
+    if "file" not in request.files:
+        return jsonify({"message": "File is required"}), 400
+    import_file = request.files["file"]
+    file_format = get_file_format(import_file.filename, request.form.get("format"))
+    if not file_format:
+        return jsonify({"message": "Invalid format, use a csv or jsonl file"}), 400
+    try:
+        records = read_records(import_file.stream, file_format)
+        report = import_records(records, current_user.id, current_app.config["IMPORT_CHUNK_SIZE"])
+        return jsonify(report), 200
+    except Exception as e:
+        return jsonify({"message": "There was an error importing the owners", "error": str(e)}), 400
+
+
 @owner.route("/update/information/<int:owner_id>", methods=["PUT"])
 @token_required
 def update_owner_information(current_user, owner_id):
@@ -122,16 +152,15 @@ def update_owner_information(current_user, owner_id):
     if user_check:
         return jsonify({"message": "Email already registered"}), 400
 
-    owner_info = get_owner_by_id(owner_id)
+    owner_info = get_owner_by_id(owner_id, *OWNER_JSON_OPTIONS)
     # Get the owner information
     if not owner_info or (owner_info.user_id != current_user.id):
         return jsonify({"message": "Owner not found"}), 404
     try:
-        owner_info = update_owner_info(owner_info, owner_data)
-        return (
-            jsonify({"message": "Owner information updated successfully", "owner": owner_info.get_information_json()}),
-            200,
-        )
+        # Serialized before the commit, so the owner, its patients and their photos are not loaded again
+        with unit_of_work():
+            owner_json = update_owner_info(owner_info, owner_data).get_information_json()
+        return jsonify({"message": "Owner information updated successfully", "owner": owner_json}), 200
     except Exception as e:
         return jsonify({"message": "There was an error updating owner information", "error": str(e)}), 400
 
@@ -153,16 +182,22 @@ def delete_owner(current_user, owner_id):
 @owner.route("/search", methods=["GET"])
 @token_required
 def search_owners(current_user):
-    """Search for owners"""
+    """Search for owners, the results are paged: limit is the size of the page and cursor the position given by the
+    X-Next-Cursor header of the previous page"""
     data = request.args
     search_query = data.get("s")
     if not search_query:
         return jsonify({"message": "Query is required"}), 400
+    after, limit, error = get_page_args(data)
+    if error:
+        return jsonify({"message": error}), 400
     try:
-        owners = search_owners_name(current_user, search_query)
-        if owners:
-            return jsonify(owners)
+        owners, page = search_owners_name(current_user, search_query, after, limit)
+        if owners or after is not None:
+            return page_response(owners, page, "owner.search_owners")
         return jsonify({"message": "No owners found"}), 404
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         return jsonify({"message": "Could not search owners", "error": str(e)}), 404
 
@@ -172,9 +207,28 @@ def search_owners(current_user):
 def get_owner_information(current_user, owner_id):
     """Get owner information"""
     try:
-        owner_info = get_owner_by_id(owner_id)
+        owner_info = get_owner_by_id(owner_id, *OWNER_JSON_OPTIONS)
         if not owner_info or (owner_info.user_id != current_user.id):
             return jsonify({"message": "Owner not found"}), 404
         return jsonify(owner_info.get_information_json()), 200
     except Exception as e:
         return jsonify({"message": "There was an error getting owner information", "error": str(e)}), 400
+
+
+@owner.route("/get/information/<int:owner_id>/patients", methods=["GET"])
+@token_required
+def get_owner_patients_page(current_user, owner_id):
+    """Get a page of the patients of an owner, the next page is given by the X-Next-Cursor and Link headers"""
+    after, limit, error = get_page_args(request.args)
+    if error:
+        return jsonify({"message": error}), 400
+    owner_info = get_owner_by_id(owner_id)
+    if not owner_info or (owner_info.user_id != current_user.id):
+        return jsonify({"message": "Owner not found"}), 404
+    try:
+        patients, page = get_owner_patients(owner_info, after, limit)
+        return page_response(patients, page, "owner.get_owner_patients_page", owner_id=owner_id)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"message": "There was an error getting the patients", "error": str(e)}), 400
@@ -1,38 +1,44 @@
 """ This file is used to create a blueprint for the patient routes. """
 
-import base64
-from io import BytesIO
-from PIL import Image
-from flask import Blueprint, current_app, request, jsonify, send_file
+from functools import partial
+from flask import Blueprint, current_app, request, jsonify, url_for
 from werkzeug.utils import secure_filename
 from app.decorators.decorators import token_required
 from app.models import (
+    PATIENT_JSON_OPTIONS,
+    Patient,
+    Photo,
+    get_image,
+    get_image_info,
     create_new_patient,
     get_patient_by_id,
-    get_photo_by_id,
+    get_patient_photos,
+    get_user_photo_by_id,
     create_new_photo,
     search_patients_nickname,
     update_patient_information,
     update_patient_profile_photo,
     delete_patient_information,
     patient_belong_to_user,
+    unit_of_work,
 )
 from app.models.auth.db_queries import get_user_by_email, get_user_by_id
 from app.models.patient.db_queries import (
     create_new_owner,
     get_owner_by_email,
     get_owner_by_id,
-    update_photo_information,
 )
 from app.utils.utils import (
     email_is_valid,
     phone_number_is_valid,
     text_is_valid,
-    validate_and_resize_image,
     validate_input,
 )
-from app.routes.resnet_model.resnet_model import get_model
-from app.utils.transformation import get_prediction
+from app.utils.image_storage import get_image_storage, send_image
+from app.utils.ingestion import ingest_image, ingest_images
+from app.utils.pagination import get_page_args, page_response
+from app.utils.thumbnails import create_thumbnails_quietly, get_thumbnail_size, send_thumbnail
+from app.routes.resnet_model.resnet_model import get_model_version, predict_image, submit_photo_analysis
 
 patient = Blueprint("patient", __name__)
 
@@ -59,12 +65,13 @@ def register_patient(current_user):
         return jsonify({"message": "Profile photo is required"}), 400
     profile_photo = request.files["profile_photo"]
 
-    profile_photo, error = validate_and_resize_image(profile_photo)
+    profile_photo, error = ingest_image(profile_photo)
     if error:
         return jsonify({"message": error}), 400
 
     if profile_photo:
-        profile_photo = base64.b64encode(profile_photo).decode("utf-8")
+        create_thumbnails_quietly(profile_photo.data, image=profile_photo.image)
+        profile_photo = get_image_storage().save(profile_photo.data)
         patient_data = {
             "nickname": data.get("nickname"),
             "age": data.get("age"),
@@ -85,25 +92,32 @@ def register_patient(current_user):
 
 @patient.route("/profile_photo/<int:patient_id>", methods=["GET"])
 def serve_profile_photo(patient_id):
-    """Serve the profile photo of a patient"""
-    patient_info = get_patient_by_id(patient_id)
-    if not patient_info:
+    """Serve the profile photo of a patient, or its thumbnail with ?size=, see send_image for the caching"""
+    size, error = get_thumbnail_size(request.args)
+    if error:
+        return jsonify({"message": error}), 400
+    image_info = get_image_info(Patient.profile_photo, Patient.profile_photo_hash, patient_id)
+    if not image_info:
         return jsonify({"message": "Patient not found"}), 404
-    profile_photo = patient_info.profile_photo
-    if not profile_photo:
+    if not image_info.has_image:
         return jsonify({"message": "Patient does not have a profile photo"}), 404
-    return send_file(BytesIO(base64.b64decode(profile_photo)), mimetype="image/jpeg")
+    if size:
+        return send_thumbnail(Patient.profile_photo, patient_id, image_info.image_hash, size)
+    return send_image(image_info.image_hash, partial(get_image, Patient.profile_photo, patient_id))
 
 
 @patient.route("/collection/photos/add", methods=["POST"])
 @token_required
 def add_photo(current_user):
     """Add a photo to a patient, and using the resnetmodel to save the information
+    With "async": "true" (or ASYNC_PHOTO_ANALYSIS enabled) the photo is stored and the response is a 202 with the
+    job id, the analysis runs in the background and its status is served by /collection/photos/<id>/analysis
     Example of data required:
     {
         "photo": "base64 encoded image",
         "patient_id": 1,
         "description": "Dog is playing" @optional
+        "async": "true" @optional
     }"""
 
     data = request.form
@@ -117,12 +131,12 @@ def add_photo(current_user):
     photo_file = request.files["photo"]
     filename = secure_filename(photo_file.filename)
 
-    photo_file, error = validate_and_resize_image(photo_file)
+    # Decoded once, the resized image gives the stored JPEG, the thumbnails and the input of the model
+    photo_file, error = ingest_image(photo_file)
     if error:
         return jsonify({"message": error}), 400
 
     photo_data = {
-        "photo": base64.b64encode(photo_file).decode("utf-8"),
         "filename": filename,
         "patient_id": data.get("patient_id"),
         "user_id": current_user.id,
@@ -132,53 +146,122 @@ def add_photo(current_user):
     patient_info = get_patient_by_id(photo_data["patient_id"])
     if not patient_info or not patient_belong_to_user(patient_info, current_user):
         return jsonify({"message": "Patient not found"}), 404
+    asynchronous = data.get("async", str(current_app.config["ASYNC_PHOTO_ANALYSIS"])).lower() == "true"
     try:
-        new_photo = create_new_photo(photo_data)
-        # Calling to resnet/predict/photo/<int:photo_id> , to update their predictec class and probability
-        resnet_model = get_model()
-        image = Image.open(BytesIO(photo_file))
-        DEVICE = "cpu"
-        probability, predicted_class = get_prediction(image_path=image, model=resnet_model, device=DEVICE)
-        prediction = {"predicted_class": predicted_class, "probability": str(probability)}
-        update_photo_information(new_photo, prediction)
-        return jsonify({"message": "Photo added successfully", "photo": new_photo.get_information_json()}), 201
+        if asynchronous:
+            photo_data["analysis_status"] = "pending"
+        else:
+            # Predicted before the photo is stored: it is inserted with its prediction, in one commit, and no
+            # transaction is left open during the inference
+            probability, predicted_class = predict_image(photo_file.pixels)
+            photo_data.update(
+                {
+                    "predicted_class": predicted_class,
+                    "probability": str(probability),
+                    "model_version": get_model_version(),
+                    "analysis_status": "done",
+                }
+            )
+        # The thumbnails and the photo are committed together
+        with unit_of_work():
+            create_thumbnails_quietly(photo_file.data, image=photo_file.image)
+            photo_data["photo"] = get_image_storage().save(photo_file.data)
+            new_photo = create_new_photo(photo_data)
+            photo_id, photo_json = new_photo.id, new_photo.get_information_json()
+
+        if asynchronous:
+            # Submitted after the commit, the analysis reads the photo in its own session
+            submit_photo_analysis(photo_id, photo_file.pixels)
+            return (
+                jsonify(
+                    {
+                        "message": "Photo added successfully, the analysis is in progress",
+                        "job_id": photo_id,
+                        "status_url": url_for("patient.get_photo_analysis", photo_id=photo_id, _external=True),
+                        "photo": photo_json,
+                    }
+                ),
+                202,
+            )
+        return jsonify({"message": "Photo added successfully", "photo": photo_json}), 201
     except Exception as e:
         return jsonify({"message": "Could not add photo", "error": str(e)}), 500
 
 
 @patient.route("/collection/photos/<int:photo_id>", methods=["GET"])
 def serve_photo(photo_id):
-    """Serve the photo of a patient"""
-    photo = get_photo_by_id(photo_id)
+    """Serve the photo of a patient, or its thumbnail with ?size=, see send_image for the caching"""
+    size, error = get_thumbnail_size(request.args)
+    if error:
+        return jsonify({"message": error}), 400
+    image_info = get_image_info(Photo.photo, Photo.photo_hash, photo_id)
+    if not image_info:
+        return jsonify({"message": "Photo not found"}), 404
+    if size:
+        return send_thumbnail(Photo.photo, photo_id, image_info.image_hash, size)
+    return send_image(image_info.image_hash, partial(get_image, Photo.photo, photo_id))
+
+
+@patient.route("/collection/photos/<int:photo_id>/analysis", methods=["GET"])
+@token_required
+def get_photo_analysis(current_user, photo_id):
+    """Get the status (pending, done or failed) and the result of the analysis of a photo"""
+    photo = get_user_photo_by_id(current_user, photo_id)
     if not photo:
         return jsonify({"message": "Photo not found"}), 404
-    return send_file(BytesIO(base64.b64decode(photo.photo)), mimetype="image/jpeg")
+    return jsonify(photo.get_analysis_json()), 200
 
 
 @patient.route("/information/<int:patient_id>", methods=["GET"])
 @token_required
 def get_patient_information(current_user, patient_id):
     """Get the information of a patient"""
-    patient_info = get_patient_by_id(patient_id)
+    patient_info = get_patient_by_id(patient_id, *PATIENT_JSON_OPTIONS)
     if not patient_info or not patient_belong_to_user(patient_info, current_user):
         return jsonify({"message": "Patient not found"}), 404
     return jsonify(patient_info.get_information_json())
 
 
+@patient.route("/information/<int:patient_id>/photos", methods=["GET"])
+@token_required
+def get_patient_photos_page(current_user, patient_id):
+    """Get a page of the photos of a patient, the next page is given by the X-Next-Cursor and Link headers"""
+    after, limit, error = get_page_args(request.args)
+    if error:
+        return jsonify({"message": error}), 400
+    patient_info = get_patient_by_id(patient_id)
+    if not patient_info or not patient_belong_to_user(patient_info, current_user):
+        return jsonify({"message": "Patient not found"}), 404
+    try:
+        page = get_patient_photos(patient_info, after, limit)
+        photos = [photo.get_information_json() for photo in page.items]
+        return page_response(photos, page, "patient.get_patient_photos_page", patient_id=patient_id)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"message": "Could not get the photos", "error": str(e)}), 400
+
+
 @patient.route("/search", methods=["GET"])
 @token_required
 def search_patients(current_user):
-    """Search for patients"""
+    """Search for patients, the results are paged: limit is the size of the page and cursor the position given by the
+    X-Next-Cursor header of the previous page"""
     data = request.args
     search_query = data.get("s")
     if not search_query:
         return jsonify({"message": "Query is required"}), 400
+    after, limit, error = get_page_args(data)
+    if error:
+        return jsonify({"message": error}), 400
 
     try:
-        patients = search_patients_nickname(current_user, search_query)
-        if patients:
-            return jsonify(patients)
+        patients, page = search_patients_nickname(current_user, search_query, after, limit)
+        if patients or after is not None:
+            return page_response(patients, page, "patient.search_patients")
         return jsonify({"message": "No patients found"}), 404
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         return jsonify({"message": "Could not search patients", "error": str(e)}), 404
 
@@ -206,11 +289,14 @@ def update_information(current_user, patient_id):
         "weight": data.get("weight"),
     }
     try:
-        update_patient = get_patient_by_id(patient_id)
+        update_patient = get_patient_by_id(patient_id, *PATIENT_JSON_OPTIONS)
         if not update_patient or not patient_belong_to_user(update_patient, current_user):
             return jsonify({"message": "Patient not found"}), 404
-        updated_patient = update_patient_information(update_patient, patient_data)
-        return jsonify({"message": "Patient updated successfully", "patient": updated_patient.get_information_json()})
+        # Serialized before the commit, so the patient and its photos are not loaded again
+        with unit_of_work():
+            updated_patient = update_patient_information(update_patient, patient_data)
+            patient_json = updated_patient.get_information_json()
+        return jsonify({"message": "Patient updated successfully", "patient": patient_json})
     except Exception as e:
         return jsonify({"message": "Could not update patient", "error": str(e)}), 500
 
@@ -227,22 +313,20 @@ def update_profile_photo(current_user, patient_id):
     if "profile_photo" not in request.files:
         return jsonify({"message": "Profile photo is required"}), 400
     profile_photo = request.files["profile_photo"]
-    profile_photo, error = validate_and_resize_image(profile_photo)
+    profile_photo, error = ingest_image(profile_photo)
     if error:
         return jsonify({"message": error}), 400
 
-    profile_photo = base64.b64encode(profile_photo).decode("utf-8")
     try:
-        update_patient = get_patient_by_id(patient_id)
+        update_patient = get_patient_by_id(patient_id, *PATIENT_JSON_OPTIONS)
         if not update_patient or not patient_belong_to_user(update_patient, current_user):
             return jsonify({"message": "Patient not found"}), 404
-        updated_patient = update_patient_profile_photo(update_patient, profile_photo)
-        return (
-            jsonify(
-                {"message": "Profile photo updated successfully", "patient": updated_patient.get_information_json()}
-            ),
-            200,
-        )
+        # The thumbnails and the new profile photo are committed together
+        with unit_of_work():
+            create_thumbnails_quietly(profile_photo.data, image=profile_photo.image)
+            updated_patient = update_patient_profile_photo(update_patient, get_image_storage().save(profile_photo.data))
+            patient_json = updated_patient.get_information_json()
+        return jsonify({"message": "Profile photo updated successfully", "patient": patient_json}), 200
     except Exception as e:
         return jsonify({"message": "Could not update profile photo", "error": str(e)}), 500
 
@@ -302,12 +386,10 @@ def generate_patient(current_user):
     analyzed_photo = request.files["analyzed_photo"]
     filename_analyzed = secure_filename(analyzed_photo.filename)
 
-    profile_photo, error = validate_and_resize_image(profile_photo)
-    if error:
-        return jsonify({"message": error}), 400
-    analyzed_photo, error = validate_and_resize_image(analyzed_photo)
-    if error:
-        return jsonify({"message": error}), 400
+    # Both images are normalized concurrently
+    (profile_photo, error), (analyzed_photo, analyzed_error) = ingest_images([profile_photo, analyzed_photo])
+    if error or analyzed_error:
+        return jsonify({"message": error or analyzed_error}), 400
 
     # Create the owner
     owner_data = {
@@ -346,54 +428,46 @@ def generate_patient(current_user):
     if user_check:
         return jsonify({"message": "Email already registered"}), 400
 
-    # Saving the owner
+    # The owner, the patient and the photo are committed together, a failure does not leave an orphan owner
     try:
-        new_owner = create_new_owner(owner_data)
+        with unit_of_work():
+            new_owner = create_new_owner(owner_data)
+            # Generate the patient
+            create_thumbnails_quietly(profile_photo.data, image=profile_photo.image)
+            create_thumbnails_quietly(analyzed_photo.data, image=analyzed_photo.image)
+            patient_data = {
+                "nickname": data.get("nickname"),
+                "age": data.get("age"),
+                "weight": data.get("weight"),
+                "user_id": current_user.id,
+                "owner_id": new_owner.id,
+                "profile_photo": get_image_storage().save(profile_photo.data),
+                "description": data.get("description"),
+            }
+            new_patient = create_new_patient(patient_data)
+            # Save the analyzed photo
+            photo_data = {
+                "photo": get_image_storage().save(analyzed_photo.data),
+                "filename": filename_analyzed,
+                "patient_id": new_patient.id,
+                "user_id": current_user.id,
+                "description": patient_data.get("description", None),
+                "predicted_class": data.get("class_name"),
+                "probability": data.get("probability"),
+            }
+            create_new_photo(photo_data)
+            patient_json = new_patient.get_information_json()
     except Exception as e:
-        return jsonify({"message": "Could not create owner", "error": str(e)}), 500
+        return jsonify({"message": "Could not generate patient", "error": str(e)}), 500
 
-    # Generate the patient
-
-    patient_data = {
-        "nickname": data.get("nickname"),
-        "age": data.get("age"),
-        "weight": data.get("weight"),
-        "user_id": current_user.id,
-        "owner_id": new_owner.id,
-        "profile_photo": base64.b64encode(profile_photo).decode("utf-8"),
-        "description": data.get("description"),
-    }
-    try:
-        new_patient = create_new_patient(patient_data)
-    except Exception as e:
-        return jsonify({"message": "Could not create patient", "error": str(e)}), 500
-
-    # Save the analyzed photo
-    photo_data = {
-        "photo": base64.b64encode(analyzed_photo).decode("utf-8"),
-        "filename": filename_analyzed,
-        "patient_id": new_patient.id,
-        "user_id": current_user.id,
-        "description": patient_data.get("description", None),
-        "predicted_class": data.get("class_name"),
-        "probability": data.get("probability"),
-    }
-    try:
-        _ = create_new_photo(photo_data)
-    except Exception as e:
-        return jsonify({"message": "Could not add photo", "error": str(e)}), 500
-
-    return (
-        jsonify({"message": "Patient created successfully", "patient": new_patient.get_information_json()}),
-        201,
-    )
+    return jsonify({"message": "Patient created successfully", "patient": patient_json}), 201
 
 
 @patient.route("/generate/pdf/<int:patient_id>", methods=["GET"])
 @token_required
 def generate_pdf(current_user, patient_id):
     """Generate the PDF of the patient"""
-    patient_info = get_patient_by_id(patient_id)
+    patient_info = get_patient_by_id(patient_id, *PATIENT_JSON_OPTIONS)
     if not patient_info or not patient_belong_to_user(patient_info, current_user):
         return jsonify({"message": "Patient not found"}), 404
     # Generate the PDF information
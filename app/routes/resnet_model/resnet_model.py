@@ -1,38 +1,231 @@
 """ This file contains the API for the ResNet model. """
 
 import io
-import os
-import base64
-import requests
-from cachetools import cached, TTLCache
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from PIL import Image
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy.orm import undefer
 from app.decorators.decorators import token_required
-from app.utils.transformation import get_prediction, load_model
-from app.models import get_photo_by_id, update_photo_information, photo_belong_to_user
+from app.utils.batching import BatchError, BatchScheduler, wait_result
+from app.utils.backends import load_backend
+from app.utils.image_storage import get_image_storage
+from app.utils.inference_server import InferenceClient
+from app.utils.model_artifacts import ModelArtifact
+from app.utils.model_registry import ModelRegistry
+from app.utils.prediction_cache import DatabasePredictionStore, PredictionCache, image_digest
+from app.utils.transformation import get_predictions, prepare_image
+from app.models import (
+    Photo,
+    get_photo_by_id,
+    get_user_photo_by_id,
+    get_user_photos_by_ids,
+    update_photo_information,
+    update_photos_predictions,
+)
 
 resnet = Blueprint("resnet", __name__)
 
-MODEL_PATH = "./model_petnet_50_new.pth"
 # device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 DEVICE = "cpu"
 
-if not os.path.exists(MODEL_PATH):
-    response = requests.get(
-        "https://onedrive.live.com/download?resid=E1236C32112E61C0%213983&authkey=!ADtKWzTvdvuJkpo", timeout=10
-    )
-    # https://onedrive.live.com/download?resid=E1236C32112E61C0%213935&authkey=!AE2FFtjkWzjLN_E
-    with open(MODEL_PATH, "wb") as f:
-        f.write(response.content)
 
-# Cache for the model with max size of 1 and TTL of 60 seconds
-cache = TTLCache(maxsize=1, ttl=60)
+def get_model_artifact() -> ModelArtifact:
+    """Get the weight file manager of the application, creating it on first use"""
+    artifact = current_app.extensions.get("model_artifact")
+    if artifact is None:
+        config = current_app.config
+        artifact = current_app.extensions.setdefault(
+            "model_artifact",
+            ModelArtifact(
+                config["MODEL_PATH"],
+                url=config["MODEL_URL"],
+                sha256=config["MODEL_SHA256"],
+                cache_dir=config["MODEL_CACHE_DIR"],
+            ),
+        )
+    return artifact
+
+
+def get_model_registry() -> ModelRegistry:
+    """Get the model registry of the application, creating it on first use"""
+    registry = current_app.extensions.get("model_registry")
+    if registry is None:
+        registry = current_app.extensions.setdefault(
+            "model_registry",
+            ModelRegistry(
+                partial(
+                    load_backend,
+                    device_name=DEVICE,
+                    backend=current_app.config["INFERENCE_BACKEND"],
+                    precision=current_app.config["INFERENCE_PRECISION"],
+                    calibration_dir=current_app.config["INFERENCE_CALIBRATION_DIR"],
+                ),
+                resolve=get_model_artifact().resolve,
+                checksum=get_model_artifact().checksum,
+                check_interval=current_app.config["MODEL_CHECK_INTERVAL"],
+                label=f"{current_app.config['INFERENCE_BACKEND']}:{current_app.config['INFERENCE_PRECISION']}",
+            ),
+        )
+    return registry
 
 
-@cached(cache)
 def get_model():
-    """Load the model from the cache or load it if it's not in the cache"""
-    return load_model(model_path=MODEL_PATH, device_name=DEVICE)
+    """Get the resident model, it is loaded once and only reloaded when the weight file changes"""
+    return get_model_registry().get()
+
+
+def get_inference_client() -> InferenceClient:
+    """Get the client of the inference server of the application, creating it on first use"""
+    client = current_app.extensions.get("inference_client")
+    if client is None:
+        client = current_app.extensions.setdefault(
+            "inference_client",
+            InferenceClient(
+                current_app.config["INFERENCE_SERVER_ADDRESS"],
+                authkey=current_app.config["SECRET_KEY"].encode("utf-8"),
+                version_ttl=current_app.config["MODEL_CHECK_INTERVAL"],
+                # A little longer than the server, so the error of the server comes first
+                timeout=current_app.config["INFERENCE_SERVER_TIMEOUT"] + 5,
+            ),
+        )
+    return client
+
+
+def predict_batch(registry: ModelRegistry, images: list) -> list:
+    """Run a list of images through the model in one forward pass"""
+    try:
+        model = registry.get()
+    except Exception as e:
+        # None of the images can be predicted, they are not retried one by one
+        raise BatchError(f"The model could not be loaded: {e}") from e
+    return get_predictions(images, model=model, device=DEVICE)
+
+
+def get_scheduler() -> BatchScheduler:
+    """Get the batching scheduler of the application, creating it on first use"""
+    scheduler = current_app.extensions.get("inference_scheduler")
+    if scheduler is None:
+        if current_app.config["INFERENCE_SERVER_ADDRESS"]:
+            # The model runs in the inference server, this process only sends the batches
+            process_batch = get_inference_client().predict_batch
+        else:
+            process_batch = partial(predict_batch, get_model_registry())
+        scheduler = current_app.extensions.setdefault(
+            "inference_scheduler",
+            BatchScheduler(
+                process_batch,
+                max_batch_size=current_app.config["INFERENCE_MAX_BATCH_SIZE"],
+                window_ms=current_app.config["INFERENCE_BATCH_WINDOW_MS"],
+            ),
+        )
+    return scheduler
+
+
+def get_model_version() -> str:
+    """Identifier of the weights, backend and precision used for the predictions"""
+    if current_app.config["INFERENCE_SERVER_ADDRESS"]:
+        return get_inference_client().version()
+    registry = get_model_registry()
+    # Make sure the weights are loaded so their version is known
+    registry.get()
+    return registry.version
+
+
+def get_prediction_cache() -> PredictionCache:
+    """Get the prediction cache of the application, creating it on first use"""
+    cache = current_app.extensions.get("prediction_cache")
+    if cache is None:
+        store = DatabasePredictionStore() if current_app.config["PREDICTION_CACHE_PERSISTENT"] else None
+        cache = current_app.extensions.setdefault(
+            "prediction_cache", PredictionCache(maxsize=current_app.config["PREDICTION_CACHE_SIZE"], store=store)
+        )
+    return cache
+
+
+def predict_image(image) -> tuple:
+    """Get the (probability, predicted_class) of an image
+    The image is resized and cropped once, the prediction is looked up by the hash of those pixels and the model
+    version, on a miss the pixels are batched with the concurrent requests. Identical concurrent requests share a
+    single inference.
+    """
+    pixels = prepare_image(image)
+    key = (image_digest(pixels), get_model_version())
+    timeout = current_app.config["INFERENCE_TIMEOUT"]
+    return get_prediction_cache().get_or_compute(key, lambda: get_scheduler().run(pixels, timeout=timeout))
+
+
+def predict_images(images: list) -> list:
+    """Get the predictions of several images at once
+    Cached predictions are reused and the rest of the images are queued together, so they run in one batched forward
+    pass. Returns one (probability, predicted_class) per image, or the exception raised while processing it. Images
+    that could not be opened can be given as the exception raised, it is returned as is.
+    """
+    cache = get_prediction_cache()
+    model_version = get_model_version()
+    results = [None] * len(images)
+    pending = []
+    for index, image in enumerate(images):
+        if isinstance(image, Exception):
+            results[index] = image
+            continue
+        try:
+            pixels = prepare_image(image)
+            key = (image_digest(pixels), model_version)
+            results[index] = cache.get(key)
+            if results[index] is None:
+                pending.append((index, key, pixels))
+        except Exception as e:
+            results[index] = e
+
+    scheduler = get_scheduler()
+    futures = [scheduler.submit(pixels) for _, _, pixels in pending]
+    deadline = time.monotonic() + current_app.config["INFERENCE_TIMEOUT"]
+    for (index, key, _), future in zip(pending, futures):
+        try:
+            results[index] = wait_result(future, max(0.0, deadline - time.monotonic()))
+            cache.set(key, results[index])
+        except Exception as e:
+            results[index] = e
+    return results
+
+
+def get_analysis_executor() -> ThreadPoolExecutor:
+    """Get the thread pool that analyzes the photos in the background, creating it on first use"""
+    executor = current_app.extensions.get("analysis_executor")
+    if executor is None:
+        executor = current_app.extensions.setdefault(
+            "analysis_executor",
+            ThreadPoolExecutor(max_workers=current_app.config["ANALYSIS_WORKERS"], thread_name_prefix="photo-analysis"),
+        )
+    return executor
+
+
+def analyze_photo(app, photo_id: int, image) -> None:
+    """Predict the class of a stored photo and save the result, or the error, in the photo
+    image is the photo already decoded (a PIL image or the array from prepare_image)"""
+    with app.app_context():
+        photo = get_photo_by_id(photo_id)
+        if not photo:
+            return
+        try:
+            probability, predicted_class = predict_image(image)
+            analysis = {
+                "predicted_class": predicted_class,
+                "probability": str(probability),
+                "model_version": get_model_version(),
+                "analysis_status": "done",
+                "analysis_error": None,
+            }
+        except Exception as e:
+            analysis = {"analysis_status": "failed", "analysis_error": str(e)[:255]}
+        update_photo_information(photo, analysis)
+
+
+def submit_photo_analysis(photo_id: int, image) -> None:
+    """Queue the analysis of a stored photo in the background pool"""
+    get_analysis_executor().submit(analyze_photo, current_app._get_current_object(), photo_id, image)
 
 
 @resnet.route("/predict", methods=["POST"])
@@ -43,11 +236,8 @@ def predict(_):
         # Get the image from the POST request
         image = request.files["file"]
         image = Image.open(io.BytesIO(image.read()))
-        # Get the model from cache or load it if it's not in the cache
-        resnet_model = get_model()
-
-        # Make a prediction
-        probability, predicted_class = get_prediction(image_path=image, model=resnet_model, device=DEVICE)
+        # Make a prediction, batched with the other concurrent requests
+        probability, predicted_class = predict_image(image)
         # Return the prediction in JSON format
         return jsonify({"class_name": predicted_class, "probability": probability})
 
@@ -64,8 +254,8 @@ def predict_save_photo(current_user, photo_id):
     }
     """
     if request.method == "POST":
-        photo = get_photo_by_id(photo_id)
-        if not photo or not photo_belong_to_user(photo, current_user):
+        photo = get_user_photo_by_id(current_user, photo_id)
+        if not photo:
             return jsonify({"message": "Photo not found"}), 404
 
         data = request.json
@@ -88,21 +278,95 @@ def predict_save_photo(current_user, photo_id):
 def predict_photo(current_user, photo_id):
     """Simple API to predict the class of an image"""
     if request.method == "GET":
-        photo = get_photo_by_id(photo_id)
-        if not photo or not photo_belong_to_user(photo, current_user):
+        # The image is read by the same query, it is always needed
+        photo = get_user_photo_by_id(current_user, photo_id, undefer(Photo.photo))
+        if not photo:
             return jsonify({"message": "Photo not found"}), 404
         try:
-            # If photo.photo is a string representing the image data
-            image_data = base64.b64decode(photo.photo)
+            image_data = get_image_storage().read(photo.photo)
             image = Image.open(io.BytesIO(image_data))
-            # Get the model from cache or load it if it's not in the cache
-            resnet_model = get_model()
-
-            probability, predicted_class = get_prediction(image_path=image, model=resnet_model, device=DEVICE)
+            probability, predicted_class = predict_image(image)
             prediction = {"predicted_class": predicted_class, "probability": str(probability)}
-            update_photo_information(photo, prediction)
+            update_photo_information(
+                photo,
+                {
+                    **prediction,
+                    "model_version": get_model_version(),
+                    "analysis_status": "done",
+                    "analysis_error": None,
+                },
+            )
             return jsonify(prediction)
         except Exception as e:
             return jsonify({"message": f"Error: {str(e)}"}), 400
 
     return jsonify({"message": "This was not a GET request"})
+
+
+@resnet.route("/predict/batch", methods=["POST"])
+@token_required
+def predict_many(current_user):
+    """Predict the class of several images in one batched forward pass
+    Send the images as multipart files with the key "files", or a json with the ids of stored photos, the predictions
+    of the stored photos are saved in the database in one transaction:
+    {
+        "photo_ids": [1, 2, 3]
+    }
+    """
+    max_items = current_app.config["INFERENCE_MAX_BATCH_REQUEST"]
+    files = request.files.getlist("files")
+    if files:
+        if len(files) > max_items:
+            return jsonify({"message": f"A maximum of {max_items} images can be predicted at once"}), 400
+        images, results = [], []
+        for file in files:
+            try:
+                images.append(Image.open(io.BytesIO(file.read())))
+            except Exception as e:
+                images.append(e)
+        for file, prediction in zip(files, predict_images(images)):
+            if isinstance(prediction, Exception):
+                results.append({"filename": file.filename, "error": str(prediction)})
+            else:
+                probability, predicted_class = prediction
+                results.append({"filename": file.filename, "class_name": predicted_class, "probability": probability})
+        return jsonify({"results": results})
+
+    data = request.get_json(silent=True) or {}
+    photo_ids = data.get("photo_ids")
+    if not photo_ids or not isinstance(photo_ids, list):
+        return jsonify({"message": "files or photo_ids are required"}), 400
+    if len(photo_ids) > max_items:
+        return jsonify({"message": f"A maximum of {max_items} photos can be predicted at once"}), 400
+
+    try:
+        photos = {photo.id: photo for photo in get_user_photos_by_ids(current_user, photo_ids)}
+        found = [photos[photo_id] for photo_id in photo_ids if photo_id in photos]
+        storage = get_image_storage()
+        images = []
+        for photo in found:
+            try:
+                images.append(Image.open(io.BytesIO(storage.read(photo.photo))))
+            except Exception as e:
+                images.append(e)
+        predictions = predict_images(images)
+        predictions = dict(zip([photo.id for photo in found], predictions))
+
+        model_version = get_model_version()
+        results, updates = [], []
+        for photo_id in photo_ids:
+            prediction = predictions.get(photo_id)
+            if prediction is None:
+                results.append({"photo_id": photo_id, "error": "Photo not found"})
+            elif isinstance(prediction, Exception):
+                results.append({"photo_id": photo_id, "error": str(prediction)})
+            else:
+                probability, predicted_class = prediction
+                data = {"predicted_class": predicted_class, "probability": str(probability)}
+                analysis = {"model_version": model_version, "analysis_status": "done", "analysis_error": None}
+                updates.append((photos[photo_id], {**data, **analysis}))
+                results.append({"photo_id": photo_id, **data})
+        update_photos_predictions(updates)
+        return jsonify({"results": results})
+    except Exception as e:
+        return jsonify({"message": f"Error: {str(e)}"}), 400
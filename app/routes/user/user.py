@@ -1,18 +1,22 @@
 """This module contains the user routes"""
 
-import base64
-from io import BytesIO
-from flask import Blueprint, request, jsonify, send_file
+from functools import partial
+from flask import Blueprint, request, jsonify
 from app.models import (
     User,
+    get_image,
+    get_image_info,
     get_user_information,
     get_user_by_id,
     update_user_info,
     update_user_password,
     get_user_by_email,
     delete_user,
+    unit_of_work,
 )
 from app.decorators.decorators import token_required
+from app.utils.image_storage import send_image
+from app.utils.thumbnails import get_thumbnail_size, send_thumbnail
 from app.utils.utils import (
     email_is_valid,
     send_restore_password_mail,
@@ -41,15 +45,21 @@ def get_user(current_user):
 @user.route("/profile_photo/<int:user_id>", methods=["GET"])
 @token_required
 def serve_profile_picture(_, user_id):
-    """Serve the profile photo of a user"""
+    """Serve the profile photo of a user, or its thumbnail with ?size=, see send_image for the caching"""
+    size, error = get_thumbnail_size(request.args)
+    if error:
+        return jsonify({"message": error}), 400
     try:
-        user_info = get_user_by_id(user_id)
-        if not user_info:
+        image_info = get_image_info(User.profile_picture, User.profile_picture_hash, user_id)
+        if not image_info:
             return jsonify({"message": "User not found"}), 404
-        profile_picture = user_info.profile_picture
-        if not profile_picture:
+        if not image_info.has_image:
             return jsonify({"message": "Profile photo not found"}), 404
-        return send_file(BytesIO(base64.b64decode(profile_picture)), mimetype="image/jpeg")
+        if size:
+            return send_thumbnail(User.profile_picture, user_id, image_info.image_hash, size, private=True)
+        return send_image(
+            image_info.image_hash, partial(get_image, User.profile_picture, user_id), private=True
+        )
     except Exception as e:
         return jsonify({"message": "There was an error getting the profile photo", "error": str(e)}), 400
 
@@ -98,8 +108,9 @@ def update_user(current_user):
             return response
 
     try:
-        user_info = get_user_by_id(current_user.id)
-        _ = update_user_info(user_info, data)
+        with unit_of_work():
+            user_info = get_user_by_id(current_user.id)
+            _ = update_user_info(user_info, data)
         return jsonify({"message": "User information updated successfully"}), 200
     except Exception as e:
         return jsonify({"message": "There was an error updating user information", "error": str(e)}), 400
@@ -125,7 +136,8 @@ def update_password(current_user):
         if not User.check_passwords_equal(data["new_password"], data["confirm_password"]):
             return jsonify({"message": "Passwords do not match"}), 400
 
-        _ = update_user_password(user_info, data)
+        with unit_of_work():
+            _ = update_user_password(user_info, data)
         return jsonify({"message": "Password updated successfully"}), 200
     except Exception as e:
         return jsonify({"message": "There was an error updating the password", "error": str(e)}), 400
@@ -202,7 +214,8 @@ def restore_password_update():
         return jsonify({"message": "Passwords do not match"}), 400
 
     try:
-        _ = update_user_password(user_info, data)
+        with unit_of_work():
+            _ = update_user_password(user_info, data)
         return jsonify({"message": "Password updated successfully"}), 200
     except Exception as e:
         return jsonify({"message": "There was an error updating the password", "error": str(e)}), 400
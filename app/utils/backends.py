@@ -0,0 +1,162 @@
+"""This module contains the inference backends that run the PetNet model. Every backend behaves like a PyTorch module
+(eval() and a call that receives the normalized image batch and returns the logits), so get_predictions applies the
+same softmax and "No se puede determinar" threshold whatever runtime executes the forward pass."""
+
+import io
+import os
+import tempfile
+import numpy as np
+import torch
+from app.utils.quantization import freeze_model, prepare_model
+from app.utils.transformation import load_model
+
+try:
+    import onnxruntime
+except ImportError:  # onnxruntime is only required by the onnx backend
+    onnxruntime = None
+
+BACKENDS = ["eager", "torchscript", "onnx"]
+
+
+def _temporary_path(path: str) -> str:
+    """Create an empty temporary file, unique to the caller, in the directory of path and return its path"""
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), suffix=".part", delete=False) as tmp:
+        return tmp.name
+
+
+def _remove(path: str) -> None:
+    """Remove a temporary file, if it was not moved in place"""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class EagerBackend:
+    """Run the model as a regular PyTorch module"""
+
+    def __init__(self, model) -> None:
+        self.model = model.eval()
+
+    def eval(self):
+        """The model is always in evaluation mode"""
+        return self
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(tensor)
+
+
+class TorchScriptBackend(EagerBackend):
+    """Run the model traced and frozen with TorchScript"""
+
+    def __init__(self, model) -> None:
+        if not isinstance(model, torch.jit.ScriptModule):
+            model = freeze_model(model.eval())
+        super().__init__(model)
+
+
+class OnnxBackend:
+    """Run the model exported to ONNX in a local ONNX Runtime session
+    The graph is exported next to the weights and reused while it is newer than the weight file.
+    """
+
+    def __init__(self, model, export_path: str, weights_path: str = None, quantize: bool = False) -> None:
+        if onnxruntime is None:
+            raise ImportError("The onnx inference backend requires the onnxruntime package")
+        if quantize:
+            export_path = export_path.replace(".onnx", ".int8.onnx")
+        if not self._is_up_to_date(export_path, weights_path):
+            self.export(model, export_path, quantize=quantize)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(export_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def _is_up_to_date(export_path: str, weights_path: str = None) -> bool:
+        """Check if the exported graph exists and is newer than the weights"""
+        if not os.path.exists(export_path):
+            return False
+        if weights_path and os.path.exists(weights_path):
+            return os.path.getmtime(export_path) >= os.path.getmtime(weights_path)
+        return True
+
+    @staticmethod
+    def export(model, export_path: str, quantize: bool = False) -> None:
+        """Export the model to ONNX with a dynamic batch size, optionally quantizing its weights to int8
+        Every file is written to a unique temporary file and moved in place, the workers preloading the model at the
+        same time never read nor overwrite a partial graph.
+        """
+        fp32_path = export_path.replace(".int8.onnx", ".onnx") if quantize else export_path
+        # Exported in memory so the weights are embedded in a single file instead of an external data file
+        graph = io.BytesIO()
+        torch.onnx.export(
+            model.eval(),
+            torch.zeros(1, 3, 224, 224),
+            graph,
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        )
+        tmp_path = _temporary_path(fp32_path)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(graph.getvalue())
+            os.replace(tmp_path, fp32_path)
+        finally:
+            _remove(tmp_path)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+
+            preprocessed_path, quantized_path = _temporary_path(export_path), _temporary_path(export_path)
+            try:
+                # The graph has to be shape inferred and optimized before quantizing it
+                quant_pre_process(fp32_path, preprocessed_path)
+                quantize_dynamic(preprocessed_path, quantized_path, weight_type=QuantType.QInt8)
+                os.replace(quantized_path, export_path)
+            finally:
+                _remove(preprocessed_path)
+                _remove(quantized_path)
+
+    def eval(self):
+        """The session is always in evaluation mode"""
+        return self
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        inputs = {self.input_name: np.ascontiguousarray(tensor.cpu().numpy(), dtype=np.float32)}
+        return torch.from_numpy(self.session.run(None, inputs)[0])
+
+
+def create_backend(model, backend: str = "eager", precision: str = "fp32", calibration_dir: str = None, **kwargs):
+    """Build the configured backend for the model
+    The onnx backend is exported from the fp32 model and quantized by ONNX Runtime when the precision is int8.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Invalid inference backend {backend}, it should be one of {BACKENDS}")
+    if backend == "onnx":
+        return OnnxBackend(
+            model,
+            export_path=kwargs.get("export_path"),
+            weights_path=kwargs.get("weights_path"),
+            quantize=precision == "int8",
+        )
+    model = prepare_model(model, precision=precision, calibration_dir=calibration_dir)
+    if backend == "torchscript":
+        return TorchScriptBackend(model)
+    return EagerBackend(model)
+
+
+def load_backend(
+    model_path: str, device_name: str = "cpu", backend: str = "eager", precision: str = "fp32", calibration_dir=None
+):
+    """Load the ResNet model from the model_path and wrap it in the configured backend and precision"""
+    model = load_model(model_path=model_path, device_name=device_name)
+    return create_backend(
+        model,
+        backend=backend,
+        precision=precision,
+        calibration_dir=calibration_dir,
+        export_path=os.path.splitext(model_path)[0] + ".onnx",
+        weights_path=model_path,
+    )
@@ -0,0 +1,113 @@
+"""This module contains the micro-batching scheduler used in front of the ResNet model. Requests coming from many
+request threads are queued, grouped for a short window and run through the model in a single stacked forward pass."""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class BatchError(RuntimeError):
+    """Error of a whole batch rather than of one of its items, for example the model could not be loaded"""
+
+
+# Errors that would fail every item of the batch again, the items are not retried one by one
+BATCH_ERRORS = (BatchError, TimeoutError, FutureTimeoutError, OSError, EOFError)
+
+
+class BatchScheduler:
+    """Collect items submitted from several threads and process them together.
+    A batch is dispatched when it reaches max_batch_size items or when window_ms milliseconds have passed since its
+    first item arrived, whichever happens first. The window is only waited under concurrency, when other items are
+    already queued or the previous batch had several items: a lone item (always the case with the sync workers of
+    gunicorn, one request at a time per process) is dispatched at once.
+    Each caller receives only the result of its own item. When a batch fails because of one of its items, the items are
+    retried one by one, when it fails as a whole (BATCH_ERRORS: the model could not be loaded, it did not answer in
+    time) every item fails with the same error.
+    """
+
+    def __init__(self, process_batch, max_batch_size: int = 16, window_ms: float = 10.0) -> None:
+        """Initialize the scheduler, process_batch receives a list of items and must return a list of results"""
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window = max(0.0, float(window_ms)) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._last_batch_size = 0
+
+    def submit(self, item) -> Future:
+        """Queue an item and return a future with its result"""
+        future = Future()
+        if self.max_batch_size == 1 or self.window == 0:
+            # Batching disabled, process the item in the caller thread
+            self._dispatch([(item, future)])
+            return future
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def run(self, item, timeout: float = None):
+        """Queue an item and wait for its result, raise TimeoutError if it is not ready in timeout seconds"""
+        return wait_result(self.submit(item), timeout)
+
+    def _ensure_worker(self) -> None:
+        """Start the worker thread, also after a fork where the thread of the parent process is not copied"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name="inference-batch-scheduler", daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> list:
+        """Block until one item arrives, then wait up to the window for more items when there is concurrency"""
+        batch = [self._queue.get()]
+        if self._queue.empty() and self._last_batch_size <= 1:
+            self._last_batch_size = 1
+            return batch
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        self._last_batch_size = len(batch)
+        return batch
+
+    def _dispatch(self, batch: list) -> None:
+        """Process a batch and hand each future its own result"""
+        items = [item for item, _ in batch]
+        try:
+            results = self.process_batch(items)
+        except Exception as e:
+            if len(batch) == 1 or isinstance(e, BATCH_ERRORS):
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            # One bad item should not fail the whole batch, retry them one by one
+            for pending in batch:
+                self._dispatch([pending])
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _loop(self) -> None:
+        """Worker thread main loop"""
+        while True:
+            self._dispatch(self._collect())
+
+
+def wait_result(future: Future, timeout: float = None):
+    """Wait for the result of a future of the scheduler, raise TimeoutError if it is not ready in timeout seconds"""
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if future.done():
+            # The item itself failed with a timeout
+            raise
+        raise TimeoutError(f"The prediction was not ready in {timeout}s") from None
@@ -0,0 +1,133 @@
+"""This module contains the micro-benchmark of the image path: validate_and_resize_image, transform_image, load_model
+and get_prediction are timed on synthetic images at several batch sizes and torch thread counts. The images and the
+random weights are generated from a seed, so the benchmark is reproducible and runs offline without the trained weights.
+"""
+
+import io
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import models
+from app.utils.transformation import get_predictions, load_model, transform_image
+from app.utils.utils import validate_and_resize_image
+
+
+def synthetic_images(count: int, size: tuple = (1024, 768), seed: int = 0) -> list:
+    """Generate count random RGB JPEG photos, returned as their encoded bytes"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        # A smooth gradient plus noise, so the JPEGs have a realistic size (pure noise does not compress)
+        gradient = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None]
+        pixels = gradient + rng.normal(0, 25, (size[1], size[0], 3)).astype(np.float32)
+        byte_array = io.BytesIO()
+        Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(byte_array, format="JPEG", quality=90)
+        images.append(byte_array.getvalue())
+    return images
+
+
+def random_weights(path: str, seed: int = 0) -> None:
+    """Save the weights of a randomly initialized PetNet model (ResNet50 with 4 classes) in path"""
+    torch.manual_seed(seed)
+    model = models.resnet50(weights=None)
+    model.fc = torch.nn.Linear(model.fc.in_features, 4)
+    torch.save(model.state_dict(), path)
+
+
+def summarize(timings: list, images_per_call: int) -> dict:
+    """p50/p95 latency in milliseconds and throughput of a list of timings in seconds"""
+    timings = np.asarray(timings)
+    return {
+        "calls": len(timings),
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(timings, 95)) * 1000, 3),
+        "images_per_second": round(images_per_call * len(timings) / float(timings.sum()), 2),
+    }
+
+
+def measure(function, iterations: int, warmup: int) -> list:
+    """Call function warmup times and then return the duration of iterations calls"""
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_benchmark(
+    model_path: str = None,
+    batch_sizes: tuple = (1, 8, 32),
+    threads: tuple = (1,),
+    iterations: int = 20,
+    warmup: int = 3,
+    image_size: tuple = (1024, 768),
+    device: str = "cpu",
+    seed: int = 0,
+) -> dict:
+    """Benchmark every stage of the image path and return the results
+    The trained weights in model_path are used when they exist, otherwise random weights are generated (the latency
+    of the model does not depend on the values of its weights).
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        weights = "trained"
+        if not model_path or not os.path.exists(model_path):
+            weights = "random"
+            model_path = os.path.join(directory, "random_weights.pth")
+            random_weights(model_path, seed)
+
+        images = synthetic_images(max(batch_sizes), image_size, seed)
+        results = []
+        default_threads = torch.get_num_threads()
+        try:
+            for num_threads in threads:
+                torch.set_num_threads(num_threads)
+                stage = {"threads": num_threads, "batch_size": 1}
+                timings = measure(lambda: validate_and_resize_image(io.BytesIO(images[0])), iterations, warmup)
+                results.append({"stage": "validate_and_resize_image", **stage, **summarize(timings, 1)})
+                timings = measure(lambda: transform_image(Image.open(io.BytesIO(images[0]))), iterations, warmup)
+                results.append({"stage": "transform_image", **stage, **summarize(timings, 1)})
+                # Loading is slow and only happens once per process, it is measured with fewer calls
+                timings = measure(lambda: load_model(model_path, device), max(iterations // 4, 1), 1)
+                results.append({"stage": "load_model", **stage, **summarize(timings, 1)})
+
+                model = load_model(model_path, device).eval()
+                for batch_size in batch_sizes:
+                    batch = images[:batch_size]
+
+                    def predict():
+                        # Decoding is part of the stage, the images are opened again on every call
+                        return get_predictions([Image.open(io.BytesIO(image)) for image in batch], model, device)
+
+                    timings = measure(predict, iterations, warmup)
+                    stage = {"threads": num_threads, "batch_size": batch_size}
+                    results.append({"stage": "get_prediction", **stage, **summarize(timings, batch_size)})
+        finally:
+            torch.set_num_threads(default_threads)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "device": device,
+        },
+        "settings": {
+            "weights": weights,
+            "batch_sizes": list(batch_sizes),
+            "threads": list(threads),
+            "iterations": iterations,
+            "warmup": warmup,
+            "image_size": list(image_size),
+            "seed": seed,
+        },
+        "results": results,
+    }
@@ -0,0 +1,138 @@
+"""This module contains the storage of the images (photos, profile photos and profile pictures). The image columns hold
+either the raw JPEG bytes (database backend, a bytea column) or the content address of a file in a local directory
+(filesystem backend), so the images are no longer base64 encoded and decoded on every write and read."""
+
+import base64
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from flask import current_app, request, send_file
+
+BACKENDS = ["database", "filesystem"]
+# Value stored in the column for the images kept in the file store, followed by the SHA-256 of the image
+KEY_PREFIX = b"sha256:"
+# Clients keep the images requested by their content addressed URL for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def image_hash(value) -> str:
+    """SHA-256 of the image of a column value, taken from the content address when it is kept in the file store"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return hashlib.sha256(base64.b64decode(value)).hexdigest()
+    value = bytes(value)
+    if value.startswith(KEY_PREFIX):
+        return value[len(KEY_PREFIX) :].decode("ascii")
+    return hashlib.sha256(value).hexdigest()
+
+
+class ImageStorage:
+    """Save and read the images with the configured backend
+    Reading does not depend on the backend, every form of the column is understood: a content address of the file store
+    or raw bytes, so rows written by the other backend can still be served. A str (legacy base64 text) is only read from
+    the SQLite databases, on PostgreSQL the text columns must be converted to bytea (flask images convert) before the
+    app uses them, a bytea column can not hold nor return text.
+    """
+
+    def __init__(self, backend: str = "database", directory: str = None) -> None:
+        """Initialize the storage, directory is the root of the file store"""
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown image storage {backend}, use one of {', '.join(BACKENDS)}")
+        if backend == "filesystem" and not directory:
+            raise ValueError("The filesystem image storage requires a directory")
+        self.backend = backend
+        self.directory = directory
+
+    def save(self, data: bytes) -> bytes:
+        """Store the image and return the value to save in its column"""
+        if self.backend == "database":
+            return data
+        checksum = hashlib.sha256(data).hexdigest()
+        path = self._path(checksum)
+        # Content addressed: the same image is written only once
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".part", delete=False) as tmp:
+                tmp.write(data)
+            os.replace(tmp.name, path)
+        return KEY_PREFIX + checksum.encode("ascii")
+
+    def read(self, value) -> bytes:
+        """Get the bytes of an image from the value of its column"""
+        if isinstance(value, str):
+            return base64.b64decode(value)
+        value = bytes(value)
+        if value.startswith(KEY_PREFIX):
+            with open(self.path(value), "rb") as f:
+                return f.read()
+        return value
+
+    def path(self, value) -> str:
+        """Path of the file of an image kept in the file store, or None if it is kept in the database"""
+        if isinstance(value, str):
+            return None
+        value = bytes(value)
+        if not value.startswith(KEY_PREFIX):
+            return None
+        if not self.directory:
+            raise ValueError("IMAGE_STORAGE_DIR is required to read the images kept in the file store")
+        return self._path(value[len(KEY_PREFIX) :].decode("ascii"))
+
+    def is_stored(self, value) -> bool:
+        """Check if the value of a column is already in the form of the configured backend"""
+        if isinstance(value, str):
+            return False
+        return bytes(value).startswith(KEY_PREFIX) == (self.backend == "filesystem")
+
+    def send(self, value, etag: str = None):
+        """Response serving an image, files of the store are streamed from disk"""
+        path = self.path(value)
+        if path:
+            return send_file(os.path.abspath(path), mimetype="image/jpeg", etag=etag or True)
+        return send_file(BytesIO(self.read(value)), mimetype="image/jpeg", etag=etag or True)
+
+    def _path(self, checksum: str) -> str:
+        """Location of an image in the file store, spread in subdirectories by the first characters of its hash"""
+        return os.path.join(self.directory, checksum[:2], checksum)
+
+
+def get_image_storage() -> ImageStorage:
+    """Get the image storage of the app, creating it on first use"""
+    storage = current_app.extensions.get("image_storage")
+    if storage is None:
+        config = current_app.config
+        storage = current_app.extensions.setdefault(
+            "image_storage", ImageStorage(config["IMAGE_STORAGE"], config["IMAGE_STORAGE_DIR"])
+        )
+    return storage
+
+
+def send_image(etag: str, load, private: bool = False, version: str = None):
+    """Serve an image with HTTP conditional caching
+    etag is the stored hash of the image (None if it was not computed yet) and load returns the value of its column, it
+    is only called when the client does not have the current image, an If-None-Match with the hash is answered with a
+    304 without reading the image. The URLs of the images carry their hash (v): a request for the current hash is
+    cached as immutable, any other request must be revalidated. version is the hash expected in the URL when it is not
+    the etag (the thumbnails are addressed by the hash of their source). private is for the images that require a token.
+    """
+    if etag and request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        value = load()
+        etag = etag or image_hash(value)
+        response = get_image_storage().send(value, etag=etag)
+    response.set_etag(etag)
+    cache_control = response.cache_control
+    if request.args.get("v") == (version or etag):
+        cache_control.max_age = IMMUTABLE_MAX_AGE
+        cache_control.immutable = True
+        cache_control.no_cache = None
+    else:
+        cache_control.no_cache = True
+    if private:
+        cache_control.private = True
+    else:
+        cache_control.public = True
+    return response
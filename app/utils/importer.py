@@ -0,0 +1,169 @@
+"""This module contains the bulk import of the owners and patients of a vet from a CSV or JSONL file. Every record is an
+owner, with optionally one of its patients: first_name, last_name, email, phone_number, document, nickname, age and
+weight (the patients of the same owner are records repeating its email). The file is streamed in chunks, every chunk is
+validated with the rules of the register routes and inserted with multi-row statements in one transaction. The records
+of the owners already registered by the vet add their patients to them, so importing a file again duplicates its
+patients."""
+
+import codecs
+import csv
+import json
+from app.models import Owner, Patient, bulk_create_owners_and_patients, get_owners_by_emails, get_registered_user_emails
+from app.utils.utils import email_is_valid, phone_number_is_valid, text_is_valid
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+OWNER_FIELDS = ["first_name", "last_name", "email", "phone_number", "document"]
+PATIENT_FIELDS = ["nickname", "age", "weight"]
+# Same checks and messages as /owners/register
+OWNER_CHECKS = [
+    ("first_name", text_is_valid, "Invalid first name, it only can contains alphabetic values and spaces"),
+    ("last_name", text_is_valid, "Invalid last name, it only can contains alphabetic values and spaces"),
+    ("email", email_is_valid, "Invalid email"),
+    ("phone_number", phone_number_is_valid, "Invalid phone number it should start with 9 and have 9 digits"),
+]
+
+
+def get_file_format(filename: str, file_format: str = None) -> str:
+    """Format of an import file (csv or jsonl), the given one or the one of its extension. None if it is unknown"""
+    if file_format:
+        return file_format if file_format in FORMATS.values() else None
+    extension = "." + (filename or "").rsplit(".", 1)[-1].lower()
+    return FORMATS.get(extension)
+
+
+def decode_lines(stream):
+    """Stream the lines of a binary UTF-8 file as text, keeping their line endings (like newline="")
+    The uploads are a SpooledTemporaryFile, which io.TextIOWrapper can not wrap before Python 3.11 (it has no readable
+    nor seekable), so the lines are read as bytes and decoded one by one.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    for line in stream:
+        yield decoder.decode(line)
+    decoder.decode(b"", final=True)
+
+
+def read_records(stream, file_format: str):
+    """Stream the records of a binary file, yields (line number, record) where record is a dict, or the error message
+    of a line that can not be read"""
+    text = decode_lines(stream)
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, "Invalid JSON"
+            continue
+        yield line_number, record if isinstance(record, dict) else "Invalid record, every line must be a JSON object"
+
+
+def check_length(model, field: str, value: str, errors: list) -> None:
+    """Add an error if the value does not fit in the column of the model"""
+    length = model.__table__.c[field].type.length
+    if length and len(value) > length:
+        errors.append(f"{field} is too long, {length} characters at most")
+
+
+def validate_record(record: dict) -> tuple:
+    """Validate a record, returns (owner, patient or None, errors)"""
+    values = {
+        field: "" if record.get(field) is None else str(record.get(field)).strip()
+        for field in OWNER_FIELDS + PATIENT_FIELDS
+    }
+    errors = [f"{field} is required" for field in OWNER_FIELDS if not values[field]]
+    for field, validation_func, error_message in OWNER_CHECKS:
+        if values[field] and not validation_func(values[field])[0]:
+            errors.append(error_message)
+    for field in OWNER_FIELDS:
+        check_length(Owner, field, values[field], errors)
+    owner = {field: values[field] for field in OWNER_FIELDS}
+
+    if not any(values[field] for field in PATIENT_FIELDS):
+        return owner, None, errors
+    errors.extend(f"{field} is required" for field in PATIENT_FIELDS if not values[field])
+    check_length(Patient, "nickname", values["nickname"], errors)
+    patient = {"nickname": values["nickname"]}
+    try:
+        patient["age"] = int(values["age"])
+    except ValueError:
+        if values["age"]:
+            errors.append("Invalid age, it should be an integer")
+    try:
+        patient["weight"] = float(values["weight"])
+    except ValueError:
+        if values["weight"]:
+            errors.append("Invalid weight, it should be a number")
+    return owner, patient, errors
+
+
+def import_chunk(chunk: list, user_id: int, report: dict) -> None:
+    """Validate and insert a chunk of (line number, record) in one transaction, updating the report"""
+
+    def fail(line_number: int, errors: list) -> None:
+        report["failed"] += 1
+        report["errors"].append({"line": line_number, "errors": errors})
+
+    valid = []
+    for line_number, record in chunk:
+        if isinstance(record, str):
+            fail(line_number, [record])
+            continue
+        owner, patient, errors = validate_record(record)
+        if errors:
+            fail(line_number, errors)
+            continue
+        valid.append((line_number, owner, patient))
+
+    # The owners already registered (by a previous chunk or before the import) are read in one query
+    emails = list({owner["email"] for _, owner, _ in valid})
+    registered_owners = get_owners_by_emails(emails) if emails else {}
+    user_emails = get_registered_user_emails(emails) if emails else set()
+    owners, patients, imported = {}, [], []
+    for line_number, owner, patient in valid:
+        email = owner["email"]
+        if email in user_emails or (email in registered_owners and registered_owners[email][1] != user_id):
+            fail(line_number, ["Email already registered"])
+            continue
+        if email in registered_owners:
+            reference = {"owner_id": registered_owners[email][0]}
+        else:
+            # The first record of an email creates the owner, the next ones only add their patient
+            owners.setdefault(email, {**owner, "user_id": user_id})
+            reference = {"owner_email": email}
+        if patient:
+            patients.append({**patient, **reference, "user_id": user_id})
+        imported.append(line_number)
+
+    try:
+        created_owners, created_patients = bulk_create_owners_and_patients(list(owners.values()), patients)
+    except Exception as e:
+        # The whole chunk is rolled back, the error of the driver is enough (the SQL would repeat the whole chunk)
+        for line_number in imported:
+            fail(line_number, [f"Could not import the record: {getattr(e, 'orig', e)}"])
+        return
+    report["owners"] += created_owners
+    report["patients"] += created_patients
+
+
+def import_records(records, user_id: int, chunk_size: int = 1000) -> dict:
+    """Import the (line number, record) of read_records for the vet user_id, chunk_size records per transaction
+    Returns the report: the number of records read, the owners and patients created, and the errors by line of the
+    records that failed (they are skipped, the other records are imported).
+    """
+    report = {"records": 0, "owners": 0, "patients": 0, "failed": 0, "errors": []}
+    chunk = []
+    for record in records:
+        report["records"] += 1
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            import_chunk(chunk, user_id, report)
+            chunk = []
+    if chunk:
+        import_chunk(chunk, user_id, report)
+    report["errors"].sort(key=lambda error: error["line"])
+    return report
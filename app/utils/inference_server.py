@@ -0,0 +1,258 @@
+"""This module contains the out-of-process inference server. A small pool of model processes runs the ResNet model while
+the web workers stay light: they prepare the images, send the pixels over a local socket and wait for the predictions.
+The number of model replicas is then sized independently of the HTTP concurrency."""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from multiprocessing.connection import AuthenticationError, Client, Listener
+import numpy as np
+import torch
+from app.utils.backends import load_backend
+from app.utils.batching import BatchError
+from app.utils.model_registry import ModelRegistry
+from app.utils.transformation import get_predictions, prepare_image
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address: str):
+    """Parse the address of the server, a unix socket path or host:port"""
+    if ":" in address and not address.startswith(("/", ".")):
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return address
+
+
+def _worker_main(conn, settings: dict) -> None:
+    """Main loop of a model process, it loads the model, tells the server it is ready and then runs the tasks received
+    on its pipe until it receives None"""
+    torch.set_num_threads(settings["threads"])
+    loader = partial(
+        load_backend,
+        device_name=settings["device"],
+        backend=settings["backend"],
+        precision=settings["precision"],
+        calibration_dir=settings["calibration_dir"],
+    )
+    registry = ModelRegistry(
+        loader, settings["model_path"], check_interval=settings["check_interval"], label=settings["label"]
+    )
+    registry.get()
+    conn.send((True, "ready"))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        command, payload = task
+        try:
+            model = registry.get()
+            if command == "version":
+                value = registry.version
+            else:
+                value = get_predictions(list(payload), model, settings["device"])
+            conn.send((True, value))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+
+class InferenceServer:
+    """Accept connections from the web workers and dispatch their requests to a pool of model processes
+    The model processes are spawned (not forked), every one is fed by its own thread taking the next task of the server,
+    so the first idle replica takes the next batch. A task not answered in timeout seconds fails, and a replica that
+    exits (for example killed by the OOM killer) or does not answer in time fails its task and is restarted.
+    """
+
+    def __init__(self, address: str, authkey: bytes, workers: int, settings: dict, timeout: float = 30.0) -> None:
+        """Initialize the server, settings are passed to the model processes (see _worker_main)"""
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.workers = workers
+        self.settings = settings
+        self.timeout = timeout
+        self._tasks = queue.Queue()
+        self._stopping = threading.Event()
+
+    def serve_forever(self) -> None:
+        """Start the model processes and serve until interrupted"""
+        self._context = multiprocessing.get_context("spawn")
+        replicas = [
+            threading.Thread(target=self._run_replica, args=(index,), name=f"inference-replica-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for replica in replicas:
+            replica.start()
+
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # Stale socket of a previous run
+            os.remove(self.address)
+        try:
+            with Listener(self.address, authkey=self.authkey) as listener:
+                logger.info("Inference server listening on %s with %s model processes", self.address, self.workers)
+                while True:
+                    try:
+                        conn = listener.accept()
+                    except (AuthenticationError, OSError, EOFError) as e:
+                        logger.warning("Rejected connection: %s", e)
+                        continue
+                    threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self._stopping.set()
+            for _ in replicas:
+                self._tasks.put(None)
+            for replica in replicas:
+                replica.join(timeout=5)
+
+    def _handle(self, conn) -> None:
+        """Serve the requests of one connection until the client closes it"""
+        with conn:
+            while True:
+                try:
+                    command, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                future = Future()
+                self._tasks.put((future, command, payload))
+                try:
+                    result = future.result(timeout=self.timeout)
+                except FutureTimeoutError:
+                    # Still queued: no replica will take it. Running: its replica fails it on its own timeout
+                    future.cancel()
+                    result = (False, f"No model process answered in {self.timeout}s")
+                try:
+                    conn.send(result)
+                except OSError:
+                    return
+
+    def _run_replica(self, index: int) -> None:
+        """Keep a model process running and feed it the tasks, restarting it when it exits or stops answering"""
+        delay = 1.0
+        while not self._stopping.is_set():
+            parent_conn, child_conn = self._context.Pipe()
+            process = self._context.Process(target=_worker_main, args=(child_conn, self.settings), daemon=True)
+            process.start()
+            child_conn.close()
+            if self._wait_ready(process, parent_conn):
+                delay = 1.0
+                self._feed(index, process, parent_conn)
+            else:
+                logger.error("Model process %s exited while loading the model, restarting in %ss", index, delay)
+                time.sleep(delay)
+                # A model that can not be loaded is retried less and less often
+                delay = min(delay * 2, 60.0)
+            # Closing the pipe stops an idle process, on shutdown it is given a moment to exit, otherwise it is killed
+            parent_conn.close()
+            process.join(timeout=5 if self._stopping.is_set() else 0)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def _wait_ready(self, process, conn) -> bool:
+        """Wait until the model process has loaded the model, False if it exited first"""
+        while process.is_alive():
+            if conn.poll(1.0):
+                try:
+                    return conn.recv() == (True, "ready")
+                except EOFError:
+                    return False
+        return False
+
+    def _feed(self, index: int, process, conn) -> None:
+        """Send the tasks of the server to the model process until it exits, stops answering or the server stops"""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                return
+            future, command, payload = task
+            if not future.set_running_or_notify_cancel():
+                # The connection already gave up on it
+                continue
+            try:
+                conn.send((command, payload))
+                future.set_result(self._receive(process, conn))
+            except Exception as e:
+                logger.error("Model process %s failed, restarting it: %s", index, e)
+                future.set_result((False, str(e)))
+                return
+
+    def _receive(self, process, conn):
+        """Wait for the answer of the model process, raise if it exits or does not answer in time"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"The model process did not answer in {self.timeout}s")
+            if conn.poll(min(1.0, remaining)):
+                try:
+                    return conn.recv()
+                except EOFError:
+                    raise RuntimeError("The model process exited") from None
+            if not process.is_alive():
+                raise RuntimeError(f"The model process exited with code {process.exitcode}")
+
+
+class InferenceClient:
+    """Client used by the web workers, each thread keeps its own connection to the server"""
+
+    def __init__(self, address: str, authkey: bytes, version_ttl: float = 30.0, timeout: float = 35.0) -> None:
+        """Initialize the client, connections are opened on first use
+        timeout is the number of seconds a request waits for the answer of the server, a bit more than the timeout of
+        the server so its own error comes first.
+        """
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.version_ttl = version_ttl
+        self.timeout = timeout
+        self._local = threading.local()
+        self._version = None
+        self._version_at = 0.0
+
+    def _request(self, command: str, payload=None):
+        """Send a request and wait for its result, reconnecting once if the connection was lost"""
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            try:
+                if conn is None:
+                    conn = self._local.conn = Client(self.address, authkey=self.authkey)
+                conn.send((command, payload))
+                answered = conn.poll(self.timeout)
+                if answered:
+                    ok, value = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._local.conn = None
+                if attempt:
+                    raise
+        if not answered:
+            # The answer may still come later, the connection can not be reused
+            conn.close()
+            self._local.conn = None
+            raise TimeoutError(f"The inference server did not answer in {self.timeout}s")
+        if not ok:
+            # The server runs the batch as a whole, its errors are not errors of one of the images
+            raise BatchError(value)
+        return value
+
+    def predict_batch(self, images: list) -> list:
+        """Get the (probability, predicted_class) of a list of images (PIL images or prepared arrays)"""
+        return self._request("predict", np.stack([prepare_image(image) for image in images]))
+
+    def version(self) -> str:
+        """Version of the model loaded by the server, refreshed every version_ttl seconds"""
+        if self._version is None or time.monotonic() - self._version_at >= self.version_ttl:
+            self._version = self._request("version")
+            self._version_at = time.monotonic()
+        return self._version
@@ -0,0 +1,65 @@
+"""This module contains the ingestion of the uploaded images. An upload is decoded and resized once, the resized pixels
+are encoded to the stored JPEG and reduced to the thumbnails. The input of the model is taken from the stored JPEG, as
+for the photos predicted later, so both get the same prediction from the cache. The images of one request are ingested
+concurrently, Pillow releases the GIL while it decodes and resizes."""
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from flask import current_app
+from app.utils.transformation import prepare_image
+from app.utils.utils import encode_jpeg, open_and_resize_image
+
+
+class IngestedImage:
+    """An uploaded image decoded and resized to 512x512 pixels, with the JPEG bytes to store"""
+
+    def __init__(self, image, data: bytes) -> None:
+        """Initialize the ingested image with the resized PIL image and its JPEG encoding"""
+        self.image = image
+        self.data = data
+        self._pixels = None
+
+    @property
+    def pixels(self):
+        """Input of the model, the 224x224 RGB array from prepare_image, computed on first use
+        It is decoded from the stored JPEG (in draft mode, at a reduced scale) like the stored photos predicted later, so
+        the hash of the pixels, the key of the prediction cache, is the same on both paths."""
+        if self._pixels is None:
+            self._pixels = prepare_image(Image.open(io.BytesIO(self.data)))
+        return self._pixels
+
+
+def get_image_executor() -> ThreadPoolExecutor:
+    """Get the thread pool that normalizes the uploaded images, creating it on first use"""
+    executor = current_app.extensions.get("image_executor")
+    if executor is None:
+        executor = current_app.extensions.setdefault(
+            "image_executor",
+            ThreadPoolExecutor(max_workers=current_app.config["IMAGE_WORKERS"], thread_name_prefix="image-ingestion"),
+        )
+    return executor
+
+
+def _ingest(image_file, max_pixels: int) -> tuple:
+    """Ingest an image file, see ingest_image"""
+    try:
+        image, error = open_and_resize_image(image_file, max_pixels)
+        if error:
+            return None, error
+        return IngestedImage(image, encode_jpeg(image)), None
+    except Exception as e:
+        return None, str(e)
+
+
+def ingest_image(image_file) -> tuple:
+    """Validate an uploaded image file and decode it once, returns (IngestedImage, None) or (None, error message)"""
+    return _ingest(image_file, current_app.config["MAX_IMAGE_PIXELS"])
+
+
+def ingest_images(image_files: list) -> list:
+    """Ingest several image files concurrently, returns one (IngestedImage, error) pair per file in the same order"""
+    if len(image_files) < 2:
+        return [ingest_image(image_file) for image_file in image_files]
+    max_pixels = current_app.config["MAX_IMAGE_PIXELS"]
+    return list(get_image_executor().map(_ingest, image_files, [max_pixels] * len(image_files)))
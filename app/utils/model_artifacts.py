@@ -0,0 +1,115 @@
+"""This module contains the manager of the model weight file. It finds the weights in a local path or in a pre-seeded
+cache directory, downloads them only when they are missing (never at import time) and verifies their checksum before
+they are loaded."""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelArtifact:
+    """Weight file of the model
+    The file is looked up in this order: the local path, the cache directory, and finally it is downloaded from the
+    url into the cache directory (or the local path when there is no cache directory). When a sha256 is given every
+    candidate is verified and a download that does not match is discarded.
+    """
+
+    def __init__(self, path: str, url: str = None, sha256: str = None, cache_dir: str = None, timeout: int = 60):
+        """Initialize the artifact, nothing is read or downloaded until resolve is called"""
+        self.path = path
+        self.url = url
+        self.sha256 = sha256.lower() if sha256 else None
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self._checksums = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache_path(self) -> str:
+        """Location of the weights in the cache directory, named after their checksum when it is known"""
+        if not self.cache_dir:
+            return None
+        name = f"{self.sha256}.pth" if self.sha256 else os.path.basename(self.path)
+        return os.path.join(self.cache_dir, name)
+
+    def resolve(self) -> str:
+        """Return the path of verified weights, downloading them if they are not available locally"""
+        with self._lock:
+            for candidate in (self.path, self.cache_path):
+                if candidate and os.path.exists(candidate):
+                    self.verify(candidate)
+                    return candidate
+            if not self.url:
+                raise FileNotFoundError(f"Model weights not found in {self.path} and no url to download them")
+            return self._download(self.cache_path or self.path)
+
+    def verify(self, path: str) -> None:
+        """Check the checksum of the file, raise ValueError if it does not match"""
+        if not self.sha256:
+            return
+        checksum = self.checksum(path)
+        if checksum != self.sha256:
+            raise ValueError(f"Checksum mismatch for {path}: expected {self.sha256}, got {checksum}")
+
+    def checksum(self, path: str) -> str:
+        """SHA-256 of a weight file, remembered by its modification time and size so it is not hashed again"""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._checksums.get(path)
+        if cached is None or cached[0] != signature:
+            cached = self._checksums[path] = (signature, file_sha256(path))
+        return cached[1]
+
+    def _download(self, destination: str) -> str:
+        """Stream the weights to a temporary file and move it to the destination once verified"""
+        directory = os.path.dirname(os.path.abspath(destination))
+        os.makedirs(directory, exist_ok=True)
+        logger.info("Downloading model weights from %s", self.url)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=".part", delete=False) as tmp:
+            try:
+                with requests.get(self.url, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        tmp.write(chunk)
+                        digest.update(chunk)
+            except Exception:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        checksum = digest.hexdigest()
+        if self.sha256 and checksum != self.sha256:
+            os.remove(tmp.name)
+            raise ValueError(f"Checksum mismatch for the downloaded weights: expected {self.sha256}, got {checksum}")
+        shutil.move(tmp.name, destination)
+        stat = os.stat(destination)
+        self._checksums[destination] = ((stat.st_mtime_ns, stat.st_size), checksum)
+        return destination
+
+    def prefetch(self) -> threading.Thread:
+        """Resolve the weights in a background thread, so a missing file starts downloading without blocking"""
+
+        def target():
+            try:
+                self.resolve()
+            except Exception as e:
+                logger.warning("Could not prefetch the model weights: %s", e)
+
+        thread = threading.Thread(target=target, name="model-prefetch", daemon=True)
+        thread.start()
+        return thread
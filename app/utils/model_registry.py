@@ -0,0 +1,99 @@
+"""This module contains the registry that keeps the ResNet model resident in memory. The model is loaded once, concurrent
+first calls share the same load (single-flight) and it is only reloaded when the weight file on disk changes."""
+
+import os
+import threading
+import time
+from app.utils.model_artifacts import file_sha256
+
+
+class ModelRegistry:
+    """Keep a single loaded copy of a model per process
+    loader receives the model path and returns the loaded model. Every check_interval seconds a call to get compares the
+    modification time and size of the weight file, and reloads the model only if they changed. While a reload is
+    running the other threads keep using the previous model.
+    The version comes from the content of the weights, so it is the same on every host and after every restart (the
+    weight file is downloaded again on deploy, its modification time changes).
+    """
+
+    def __init__(
+        self,
+        loader,
+        model_path: str = None,
+        check_interval: float = 30.0,
+        label: str = None,
+        resolve=None,
+        checksum=file_sha256,
+    ) -> None:
+        """Initialize the registry, nothing is loaded until the first call to get
+        label is appended to the version, to tell apart the same weights loaded with different settings.
+        resolve is an optional callable returning the path of the weights, called before every load (for example to
+        download and verify them).
+        checksum returns the SHA-256 of the weight file, it is called once per load.
+        """
+        self.loader = loader
+        self.model_path = model_path
+        self.resolve = resolve
+        self.check_interval = check_interval
+        self.label = label
+        self.checksum = checksum
+        self._model = None
+        self._signature = None
+        self._digest = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        """Identifier of the weights currently loaded: the start of their SHA-256, and the label. It only changes when
+        the content of the weights changes"""
+        if self._digest is None:
+            return None
+        return f"{self._digest[:16]}:{self.label}" if self.label else self._digest[:16]
+
+    def get(self):
+        """Get the resident model, loading it on the first call"""
+        model = self._model
+        if model is None:
+            with self._lock:
+                if self._model is None:
+                    self._load()
+                return self._model
+        if self.check_interval and time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload_if_changed()
+        return self._model
+
+    def reload_if_changed(self) -> bool:
+        """Reload the model if the weight file changed since it was loaded, return True if it was reloaded"""
+        self._checked_at = time.monotonic()
+        if self._file_signature() == self._signature:
+            return False
+        with self._lock:
+            # Another thread may have already reloaded it while we were waiting for the lock
+            if self._file_signature() == self._signature:
+                return False
+            self._load()
+            return True
+
+    def _file_signature(self) -> tuple:
+        """Modification time and size of the weight file"""
+        if self.model_path is None:
+            return None
+        try:
+            stat = os.stat(self.model_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> None:
+        """Load the model, the caller must hold the lock"""
+        if self.resolve is not None:
+            self.model_path = self.resolve()
+        signature = self._file_signature()
+        digest = self.checksum(self.model_path) if signature is not None else None
+        model = self.loader(self.model_path)
+        model.eval()
+        self._model = model
+        self._signature = signature
+        self._digest = digest
+        self._checked_at = time.monotonic()
@@ -0,0 +1,76 @@
+"""This module contains the cursor (keyset) pagination of the listings. The results are ordered by id (or by relevance
+and id for the text searches) and a page is the next rows after the last one of the previous page, so every page costs
+the same whatever its position and the rows added or deleted meanwhile do not shift the pages. The cursor is the opaque
+form of the sort key of that last row."""
+
+import base64
+import json
+from typing import NamedTuple
+from flask import current_app, jsonify, request, url_for
+
+
+class Page(NamedTuple):
+    """A page of rows, after is the sort key after which the next page starts (None on the last page): the id of the
+    last row, or its [score, id] for the searches ranked by relevance"""
+
+    items: list
+    after: object = None
+
+    @property
+    def next_cursor(self) -> str:
+        """Cursor of the next page, None on the last page"""
+        return encode_cursor(self.after) if self.after is not None else None
+
+
+def encode_cursor(after) -> str:
+    """Opaque cursor of the page starting after the sort key"""
+    return base64.urlsafe_b64encode(json.dumps(after).encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Sort key after which the page of the cursor starts, an id or a (score, id) tuple. Raises ValueError if the
+    cursor is invalid"""
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii"))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if isinstance(after, int) and not isinstance(after, bool) and after >= 0:
+        return after
+    if (
+        isinstance(after, list)
+        and len(after) == 2
+        and isinstance(after[0], (int, float))
+        and isinstance(after[1], int)
+        and not any(isinstance(value, bool) for value in after)
+    ):
+        return tuple(after)
+    raise ValueError("Invalid cursor")
+
+
+def get_page_args(args) -> tuple:
+    """Get the cursor and limit query parameters of a listing, returns (after, limit, error message or None)
+    after is None for the first page. The limit defaults to PAGE_SIZE and can not exceed MAX_PAGE_SIZE.
+    """
+    config = current_app.config
+    limit = args.get("limit", str(config["PAGE_SIZE"]))
+    if not limit.isdigit() or not 1 <= int(limit) <= config["MAX_PAGE_SIZE"]:
+        return None, None, f"Invalid limit, use a number between 1 and {config['MAX_PAGE_SIZE']}"
+    cursor = args.get("cursor")
+    if not cursor:
+        return None, int(limit), None
+    try:
+        return decode_cursor(cursor), int(limit), None
+    except ValueError as e:
+        return None, None, str(e)
+
+
+def page_response(items: list, page: Page, endpoint: str, **values):
+    """Response with the items of a page, the next page is given by the X-Next-Cursor and Link headers
+    endpoint and values build the URL of the next page, the query parameters of the request (limit, s) are kept.
+    """
+    response = jsonify(items)
+    if page.next_cursor:
+        args = {**request.args.to_dict(), **values, "cursor": page.next_cursor}
+        response.headers["X-Next-Cursor"] = page.next_cursor
+        response.headers["Link"] = f'<{url_for(endpoint, **args, _external=True)}>; rel="next"'
+    return response
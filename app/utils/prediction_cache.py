@@ -0,0 +1,103 @@
+"""This module contains the content-addressed cache of the ResNet predictions. The predictions are keyed by the hash of
+the pixels fed to the model and the model version, so re-uploads of the same photo and repeated predictions of a stored
+photo do not run the model again."""
+
+import hashlib
+import threading
+from concurrent.futures import Future
+import numpy as np
+from cachetools import LRUCache
+from app.models import get_stored_prediction, save_prediction
+
+
+def image_digest(pixels: np.ndarray) -> str:
+    """Hash of the normalized pixels of an image (the array from prepare_image), independent of its file format"""
+    digest = hashlib.sha256("x".join(str(dimension) for dimension in pixels.shape).encode("utf-8"))
+    digest.update(np.ascontiguousarray(pixels).tobytes())
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Bounded LRU cache of predictions with an optional persistent store
+    The store must implement get(key) and set(key, value), it is consulted on a memory miss. Concurrent calls for the
+    same key are coalesced, only the first caller computes the prediction and the others wait for its result.
+    """
+
+    def __init__(self, maxsize: int = 1024, store=None) -> None:
+        """Initialize the cache"""
+        self.store = store
+        self._cache = LRUCache(maxsize=maxsize) if maxsize > 0 else None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value of the key, looking in memory and then in the store, or None"""
+        with self._lock:
+            if self._cache is not None and key in self._cache:
+                return self._cache[key]
+        value = self.store.get(key) if self.store is not None else None
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value) -> None:
+        """Cache the value of the key in memory and in the store"""
+        if self.store is not None:
+            self.store.set(key, value)
+        self._remember(key, value)
+
+    def _remember(self, key, value) -> None:
+        """Keep the value of the key in memory"""
+        with self._lock:
+            if self._cache is not None:
+                self._cache[key] = value
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value of the key or compute it, calling compute at most once for concurrent callers"""
+        with self._lock:
+            if self._cache is not None and key in self._cache:
+                return self._cache[key]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            value = self.store.get(key) if self.store is not None else None
+            if value is None:
+                value = compute()
+                if self.store is not None:
+                    self.store.set(key, value)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise e
+
+        with self._lock:
+            if self._cache is not None:
+                self._cache[key] = value
+            del self._in_flight[key]
+        future.set_result(value)
+        return value
+
+    def clear(self) -> None:
+        """Remove every prediction kept in memory"""
+        with self._lock:
+            if self._cache is not None:
+                self._cache.clear()
+
+
+class DatabasePredictionStore:
+    """Persistent store of the prediction cache backed by the Prediction table, the keys are (image_hash, version)"""
+
+    def get(self, key) -> tuple:
+        """Get the stored (probability, predicted_class) or None"""
+        prediction = get_stored_prediction(*key)
+        return prediction.get_result() if prediction else None
+
+    def set(self, key, value) -> None:
+        """Store the (probability, predicted_class) of the key"""
+        save_prediction(*key, *value)
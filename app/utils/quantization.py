@@ -0,0 +1,82 @@
+"""This module builds the reduced precision variants of the PetNet model used for CPU inference. The int8 variant is
+statically quantized after training with calibration images, traced with TorchScript and frozen so the batch norm layers
+are folded into the convolutions and the graph is fused for inference."""
+
+import os
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from PIL import Image
+from app.utils.transformation import get_predictions, transform_image
+
+PRECISIONS = ["fp32", "int8"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_images(directory: str, limit: int = None) -> list:
+    """Load the images of a directory as RGB PIL images, sorted by filename"""
+    filenames = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        filenames = filenames[:limit]
+    return [Image.open(os.path.join(directory, name)).convert("RGB") for name in filenames]
+
+
+def freeze_model(model):
+    """Trace the model with TorchScript and freeze it, folding batch norms and constants into the graph"""
+    example = torch.zeros(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+
+def quantize_model(model, calibration_images: list):
+    """Quantize the model to int8.
+    The whole network is statically quantized, the activation ranges are observed on the calibration images.
+    """
+    if not calibration_images:
+        # Without the activation ranges only the fully connected layer could be quantized, that is not an int8 model
+        raise ValueError("The int8 precision requires calibration images, set INFERENCE_CALIBRATION_DIR")
+    model.eval()
+
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    example = torch.zeros(1, 3, 224, 224)
+    prepared = prepare_fx(model, qconfig_mapping, (example,))
+    with torch.no_grad():
+        for image in calibration_images:
+            prepared(transform_image(image))
+    return convert_fx(prepared)
+
+
+def prepare_model(model, precision: str = "fp32", calibration_dir: str = None):
+    """Return the variant of the model used for inference according to the precision"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Invalid inference precision {precision}, it should be one of {PRECISIONS}")
+    if precision == "fp32":
+        return model
+    calibration_images = load_images(calibration_dir) if calibration_dir else []
+    return freeze_model(quantize_model(model, calibration_images))
+
+
+def measure_drift(reference, candidate, images: list, device: str = "cpu", batch_size: int = 32) -> dict:
+    """Compare the predictions of a candidate model against the reference (fp32) model on a set of images"""
+    if not images:
+        raise ValueError("At least one image is required to measure the drift")
+    reference_predictions, candidate_predictions = [], []
+    for start in range(0, len(images), batch_size):
+        batch = images[start : start + batch_size]
+        reference_predictions.extend(get_predictions(batch, reference, device))
+        candidate_predictions.extend(get_predictions(batch, candidate, device))
+    probability_drift = [
+        abs(reference_probability - candidate_probability)
+        for (reference_probability, _), (candidate_probability, _) in zip(reference_predictions, candidate_predictions)
+    ]
+    agreement = sum(
+        reference_class == candidate_class
+        for (_, reference_class), (_, candidate_class) in zip(reference_predictions, candidate_predictions)
+    )
+    return {
+        "images": len(images),
+        "class_agreement": agreement / len(images),
+        "mean_probability_drift": sum(probability_drift) / len(images),
+        "max_probability_drift": max(probability_drift),
+    }
@@ -0,0 +1,80 @@
+"""This module contains the thumbnails of the images. They are generated when an image is uploaded (and by flask images
+thumbnails for the images stored before), keyed by the hash of the source image, and served by the image routes with the
+size query parameter so the galleries do not download the full image."""
+
+import io
+import logging
+from functools import partial
+from flask import current_app
+from PIL import Image
+from app.models import Thumbnail, get_image, get_thumbnail_info, save_thumbnails, savepoint
+from app.utils.image_storage import get_image_storage, image_hash, send_image
+
+logger = logging.getLogger(__name__)
+
+
+def make_thumbnails(data: bytes, sizes: list, image=None) -> dict:
+    """Resize a JPEG image to fit in squares of every size, keeping its aspect ratio. Returns {size: jpeg bytes}
+    image is the already decoded image of data, when given data is not decoded again.
+    """
+    if image is None:
+        image = Image.open(io.BytesIO(data))
+        # Decoded once at the largest size needed, the smaller sizes are reduced from the previous one
+        image.draft("RGB", (max(sizes), max(sizes)))
+    else:
+        # Same as the draft decoding: average blocks of pixels down to the largest size needed, much cheaper than
+        # resampling the full image. reduce returns a copy, the image of the caller is not resized.
+        factor = min(image.size) // max(sizes)
+        if factor > 1:
+            image = image.reduce(factor)
+    image = image.convert("RGB")
+    thumbnails = {}
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size), Image.LANCZOS)
+        byte_array = io.BytesIO()
+        image.save(byte_array, format="JPEG", quality=85, optimize=True)
+        thumbnails[size] = byte_array.getvalue()
+    return thumbnails
+
+
+def create_thumbnails(data: bytes, sizes: list = None, image=None) -> None:
+    """Generate and store the thumbnails of an image, by default at every size of THUMBNAIL_SIZES"""
+    sizes = sizes or current_app.config["THUMBNAIL_SIZES"]
+    storage = get_image_storage()
+    thumbnails = make_thumbnails(data, sizes, image)
+    save_thumbnails(image_hash(data), {size: storage.save(image) for size, image in thumbnails.items()})
+
+
+def create_thumbnails_quietly(data: bytes, image=None) -> None:
+    """Create the thumbnails of an uploaded image, a failure is only logged since they are created again on demand
+    Inside a unit of work they are written in a savepoint, a failure only discards the thumbnails.
+    """
+    try:
+        with savepoint():
+            create_thumbnails(data, image=image)
+    except Exception as e:
+        logger.warning("Could not create the thumbnails: %s", e)
+
+
+def get_thumbnail_size(args) -> tuple:
+    """Get the size query parameter of an image request, returns (size or None, error message or None)"""
+    size = args.get("size")
+    if size is None:
+        return None, None
+    sizes = current_app.config["THUMBNAIL_SIZES"]
+    if not size.isdigit() or int(size) not in sizes:
+        return None, f"Invalid size, use one of {', '.join(str(size) for size in sizes)}"
+    return int(size), None
+
+
+def send_thumbnail(column, row_id: int, source_hash: str, size: int, private: bool = False):
+    """Serve the thumbnail of the image of a row at a size, creating the thumbnails of the image if they are missing"""
+    if source_hash is None:
+        source_hash = image_hash(get_image(column, row_id))
+    thumbnail = get_thumbnail_info(source_hash, size)
+    if thumbnail is None:
+        create_thumbnails(get_image_storage().read(get_image(column, row_id)))
+        thumbnail = get_thumbnail_info(source_hash, size)
+    return send_image(
+        thumbnail.image_hash, partial(get_image, Thumbnail.image, thumbnail.id), private=private, version=source_hash
+    )
@@ -1,71 +1,102 @@
-"""This script defines a function that transforms the input image into a tensor that can be used as input to the model. The function uses the PyTorch transforms module to apply the necessary transformations to the input image. The transformations include resizing the image to 255x255 pixels, cropping the image to 224x224 pixels, converting the image to a PyTorch tensor, and normalizing the image using the mean and standard deviation values used during training. The function returns the transformed image as a tensor."""
+"""This script defines the preprocessing that transforms the input images into the tensor used as input to the model. Each image is decoded at a reduced scale when possible (JPEG draft mode), resized so its short side is 256 pixels and center cropped to 224x224 pixels. The crops of a batch are then stacked, converted to a PyTorch tensor and normalized using the mean and standard deviation values used during training in a single vectorized step. It also contains the functions to load the model and make the predictions."""
 
-# import io
-from torchvision import transforms
+import numpy as np
+from PIL import Image
 from torchvision import models
 import torch
 
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+# Built once, shaped to broadcast over a (batch, channel, height, width) tensor
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+
+def prepare_image(image) -> np.ndarray:
+    """Resize the short side of the image to 256 pixels and center crop it to 224x224, same as
+    transforms.Resize(256) followed by transforms.CenterCrop(224). Returns the RGB pixels as a uint8 array."""
+    if isinstance(image, np.ndarray):
+        # Already prepared
+        return image
+    # Decode JPEGs at the smallest scale (1/2, 1/4, 1/8) that still covers the resize, the pixels we would throw
+    # away are never decoded. It has no effect on images that are already loaded or on other formats.
+    image.draft("RGB", (RESIZE_SIZE, RESIZE_SIZE))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width, height = image.size
+    if width <= height:
+        size = (RESIZE_SIZE, int(RESIZE_SIZE * height / width))
+    else:
+        size = (int(RESIZE_SIZE * width / height), RESIZE_SIZE)
+    if size != image.size:
+        image = image.resize(size, Image.BILINEAR)
+    left = int(round((size[0] - CROP_SIZE) / 2.0))
+    top = int(round((size[1] - CROP_SIZE) / 2.0))
+    image = image.crop((left, top, left + CROP_SIZE, top + CROP_SIZE))
+    return np.asarray(image)
+
+
+def preprocess_images(images: list) -> torch.Tensor:
+    """Transform a list of images (PIL images or arrays from prepare_image) into a normalized (N, 3, 224, 224) tensor"""
+    batch = np.stack([prepare_image(image) for image in images])
+    tensor = torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255)
+    return tensor.sub_(MEAN).div_(STD)
+
 
 def transform_image(image):
     """Transform the input image into a tensor that can be used as input to the model."""
-    my_transforms = transforms.Compose(
-        [
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ]
-    )
-    # image = Image.open(io.BytesIO(image_bytes))
-    return my_transforms(image).unsqueeze(0)
+    return preprocess_images([image])
 
 
 def load_model(model_path, device_name):
     """Load the model from the model_path and return the model"""
-    # Loading Model and making predictions
-    resnet50 = models.resnet50(weights=None)
-    # Adjust the output size of the fc layer to match the output size of the saved model parameters
-    num_ftrs = resnet50.fc.in_features
-    resnet50.fc = torch.nn.Linear(num_ftrs, 4)
-
-    # Load the trained model parameters
-    if torch.cuda.is_available():
-        resnet50.load_state_dict(torch.load(model_path))
-    else:
-        resnet50.load_state_dict(torch.load(model_path, map_location=torch.device("cpu")))
+    # Loading Model and making predictions. The layers are created on the meta device (without allocating or
+    # initializing their weights) since all of them are replaced by the trained parameters.
+    with torch.device("meta"):
+        resnet50 = models.resnet50(weights=None)
+        # Adjust the output size of the fc layer to match the output size of the saved model parameters
+        num_ftrs = resnet50.fc.in_features
+        resnet50.fc = torch.nn.Linear(num_ftrs, 4)
+
+    # Load the trained model parameters memory-mapped: the pages are read from the file on demand and shared by
+    # every process that maps it (the forked gunicorn workers) instead of each one holding a private copy
+    map_location = None if torch.cuda.is_available() else torch.device("cpu")
+    state_dict = torch.load(model_path, map_location=map_location, mmap=True, weights_only=True)
+    resnet50.load_state_dict(state_dict, assign=True)
 
     # device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     resnet50 = resnet50.to(device=device_name)
     return resnet50
 
 
-def get_prediction(image_path, model, device):
-    """Get the prediction of the image using the model"""
-    clases = ["dermatitis", "pioderma", "sarna", "sano"]
-    # with open(image_path, "rb") as f:
-    #    image_bytes = f.read()
-    #    tensor = transform_image(image_bytes=image_bytes)
-    #    img_transform = tensor.to(device)
-    tensor = transform_image(image_path)
+CLASSES = ["dermatitis", "pioderma", "sarna", "sano"]
+
+
+def get_predictions(images, model, device):
+    """Get the predictions of a list of images using the model in a single forward pass"""
+    tensor = preprocess_images(images)
     img_transform = tensor.to(device)
 
     # Make to evaluation
     model.eval()
-    output = model(img_transform)
+    with torch.no_grad():
+        output = model(img_transform)
     # Aplicando softmax para obtener las probabilidades
     probabilities = torch.nn.functional.softmax(output, dim=1)
 
-    # Get the predicted class index
-    _, predicted = torch.max(output, 1)
+    # Get the predicted class index and its probability for every image of the batch
+    predicted_probabilities, predicted = torch.max(probabilities, 1)
 
-    # Obteniendo la probabilidad de la clase predicha
-    predicted_probability = probabilities[0][predicted].item()
+    predictions = []
+    for predicted_probability, class_index in zip(predicted_probabilities.tolist(), predicted.tolist()):
+        predicted_class = CLASSES[class_index]
+        # If predicted_probability es less that 0.6, return "No se puede determinar"
+        if predicted_probability < 0.6:
+            predicted_class = "No se puede determinar"
+        predictions.append((predicted_probability, predicted_class))
+    return predictions
 
-    # Get the predicted class name
-    predicted_class = clases[predicted.item()]
 
-    # If predicted_probability es less that 0.5, return "No se puede determinar", if is less than 0.7 return "No estoy seguro"
-    if predicted_probability < 0.6:
-        predicted_class = "No se puede determinar"
-
-    return predicted_probability, predicted_class
+def get_prediction(image_path, model, device):
+    """Get the prediction of the image using the model"""
+    return get_predictions([image_path], model, device)[0]
@@ -102,19 +102,42 @@ def phone_number_is_valid(phone_number: str):
     return valid_phone_number, None
 
 
-def validate_and_resize_image(image_file):
-    """Validate the image file and resize it to 512x512 pixels"""
+def open_and_resize_image(image_file, max_pixels: int = None):
+    """Validate the image file and resize it to 512x512 pixels, returns the decoded image
+    Images with more than max_pixels pixels are rejected before they are decoded."""
     try:
         image = Image.open(image_file)
         if image.format not in ["JPEG", "JPG", "PNG"]:
             return None, "Invalid image format. Only JPG, JPEG, and PNG are allowed."
+        # Only the header has been read so far, the size is known without decoding the pixels
+        width, height = image.size
+        if max_pixels and width * height > max_pixels:
+            return None, f"Image too large ({width}x{height}), the maximum is {max_pixels} pixels."
+        # JPEGs are decoded at the smallest scale (1/2, 1/4, 1/8) that still covers 512x512, a 12 MP photo is
+        # decoded at 1/4 of its size. It has no effect on other formats.
+        image.draft("RGB", (512, 512))
         # Convert RGBA images to RGB
         if image.mode == "RGBA":
             image = image.convert("RGB")
-        resized_image = image.resize((512, 512))
-        byte_array = io.BytesIO()
-        resized_image.save(byte_array, format="JPEG")
-        return byte_array.getvalue(), None
+        return image.resize((512, 512), reducing_gap=3.0), None
+    except Exception as e:
+        return None, str(e)
+
+
+def encode_jpeg(image) -> bytes:
+    """Encode an image as JPEG"""
+    byte_array = io.BytesIO()
+    image.save(byte_array, format="JPEG")
+    return byte_array.getvalue()
+
+
+def validate_and_resize_image(image_file, max_pixels: int = None):
+    """Validate the image file and resize it to 512x512 pixels, returns the JPEG bytes"""
+    try:
+        image, error = open_and_resize_image(image_file, max_pixels)
+        if error:
+            return None, error
+        return encode_jpeg(image), None
     except Exception as e:
         return None, str(e)
 
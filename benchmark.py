@@ -0,0 +1,6 @@
+""" This file runs the benchmark of the image path (flask model benchmark) without creating the app, so without the database."""
+
+from app.commands.model import benchmark
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,172 @@
+"""Fixtures of the tests: the app on a temporary SQLite database with a logged in vet, one owner, one patient and one
+photo. The model is replaced by a stub, the tests do not need the weights."""
+
+import io
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+TEST_DIR = tempfile.mkdtemp(prefix="petnet-tests-")
+# The configuration classes read the environment when they are imported
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["MODEL_PATH"] = os.path.join(TEST_DIR, "model.pth")
+os.environ["MODEL_PRELOAD"] = "false"
+# The stub weights are not the trained ones, they are not verified
+os.environ["MODEL_SHA256"] = ""
+os.environ["SECRET_KEY"] = "test-secret-key-long-enough-for-the-tokens"
+os.environ.pop("INFERENCE_SERVER_ADDRESS", None)
+
+import pytest
+from PIL import Image
+from sqlalchemy import event
+from app import create_app
+from app.models import User, db
+from app.routes.resnet_model import resnet_model as resnet_routes
+from app.utils.model_registry import ModelRegistry
+
+PASSWORD = "password"
+
+
+class StubModel:
+    """Model of the tests, get_predictions is replaced so it is never called"""
+
+    def eval(self):
+        return self
+
+
+def stub_predictions(images, model, device) -> list:
+    """Same prediction for every image of the batch"""
+    return [(0.9, "sano") for _ in images]
+
+
+def image(color=(200, 30, 30), size=(320, 240), fmt="JPEG") -> io.BytesIO:
+    """An uploaded image of a single color"""
+    data = io.BytesIO()
+    Image.new("RGB", size, color).save(data, format=fmt)
+    data.seek(0)
+    return data
+
+
+@contextmanager
+def count_statements():
+    """Collect the SQL statements run inside the block"""
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+
+@contextmanager
+def count_commits():
+    """Count the commits of the current thread inside the block, the background analysis commits apart"""
+    commits = []
+    thread_id = threading.get_ident()
+
+    def listener(conn):
+        if threading.get_ident() == thread_id:
+            commits.append(conn)
+
+    event.listen(db.engine, "commit", listener)
+    try:
+        yield commits
+    finally:
+        event.remove(db.engine, "commit", listener)
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """The app on an empty database, with the stub model"""
+    with open(os.environ["MODEL_PATH"], "wb") as f:
+        f.write(b"stub weights")
+    monkeypatch.setattr(resnet_routes, "get_predictions", stub_predictions)
+    flask_app = create_app("testing")
+    flask_app.extensions["model_registry"] = ModelRegistry(
+        lambda path: StubModel(), os.environ["MODEL_PATH"], check_interval=0, label="stub"
+    )
+    yield flask_app
+    executor = flask_app.extensions.get("analysis_executor")
+    if executor is not None:
+        executor.shutdown(wait=True)
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_id(app):
+    """A confirmed vet"""
+    with app.app_context():
+        user = User(
+            first_name="Ana",
+            last_name="Perez",
+            email="ana@vet.com",
+            clinic="Vet",
+            address="Street 1",
+            college_number="A1",
+            username="ana",
+            password=PASSWORD,
+        )
+        user.confirmed = True
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def headers(client, user_id):
+    """Authorization header of the vet"""
+    response = client.post("/auth/login", json={"username": "ana", "password": PASSWORD})
+    assert response.status_code == 200
+    return {"Authorization": response.get_json()["token"]}
+
+
+@pytest.fixture
+def owner_id(client, headers):
+    response = client.post(
+        "/owners/register",
+        headers=headers,
+        json={
+            "first_name": "Jo",
+            "last_name": "Do",
+            "email": "jo@x.com",
+            "phone_number": "912345678",
+            "document": "123",
+        },
+    )
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+@pytest.fixture
+def patient_id(client, headers, owner_id):
+    response = client.post(
+        "/patients/register",
+        headers=headers,
+        data={"nickname": "Rex", "age": 3, "weight": 10, "owner_id": owner_id, "profile_photo": (image(), "p.jpg")},
+    )
+    assert response.status_code == 201
+    return response.get_json()["patient"]["id"]
+
+
+@pytest.fixture
+def photo_id(client, headers, patient_id):
+    response = client.post(
+        "/patients/collection/photos/add",
+        headers=headers,
+        data={"patient_id": patient_id, "photo": (image((10, 200, 10)), "a.jpg")},
+    )
+    assert response.status_code == 201
+    return response.get_json()["photo"]["id"]
@@ -0,0 +1,48 @@
+"""A batch failing as a whole fails every item at once, a batch failing because of one item is retried item by item."""
+
+from concurrent.futures import Future
+import pytest
+from app.utils.batching import BatchError, BatchScheduler
+
+
+def dispatch(process_batch, items: list) -> tuple:
+    """Dispatch the items as one batch, return their futures and the batches processed"""
+    batches = []
+
+    def recorded(batch):
+        batches.append(list(batch))
+        return process_batch(batch)
+
+    futures = [Future() for _ in items]
+    BatchScheduler(recorded)._dispatch(list(zip(items, futures)))
+    return futures, batches
+
+
+@pytest.mark.parametrize("error", [BatchError("model not found"), TimeoutError("no answer"), ConnectionResetError()])
+def test_batch_error_fails_every_item_once(error):
+    def failing(batch):
+        raise error
+
+    futures, batches = dispatch(failing, [1, 2, 3])
+    assert batches == [[1, 2, 3]]
+    assert all(future.exception() is error for future in futures)
+
+
+def test_item_error_is_retried_item_by_item():
+    def failing_on_two(batch):
+        if 2 in batch:
+            raise ValueError("bad image")
+        return [item * 10 for item in batch]
+
+    futures, batches = dispatch(failing_on_two, [1, 2, 3])
+    assert batches == [[1, 2, 3], [1], [2], [3]]
+    assert futures[0].result() == 10 and futures[2].result() == 30
+    assert isinstance(futures[1].exception(), ValueError)
+
+
+def test_run_times_out():
+    scheduler = BatchScheduler(lambda batch: [None] * len(batch))
+    # Nothing takes the queued items
+    scheduler._ensure_worker = lambda: None
+    with pytest.raises(TimeoutError, match="not ready in 0.05s"):
+        scheduler.run(1, timeout=0.05)
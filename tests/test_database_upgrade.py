@@ -0,0 +1,38 @@
+"""flask database upgrade adds the columns of the models missing in the tables created before them."""
+
+from sqlalchemy import inspect, text
+from app.commands.database import ADDED_COLUMNS
+from app.models import db
+
+
+def drop_added_columns(app) -> None:
+    """Make the tables look like the ones created before the added columns"""
+    with app.app_context():
+        with db.engine.begin() as connection:
+            for column in ADDED_COLUMNS:
+                connection.execute(text(f'ALTER TABLE "{column.class_.__tablename__}" DROP COLUMN {column.key}'))
+
+
+def missing_columns(app) -> list:
+    with app.app_context():
+        inspector = inspect(db.engine)
+        return [
+            column.key
+            for column in ADDED_COLUMNS
+            if column.key not in {info["name"] for info in inspector.get_columns(column.class_.__tablename__)}
+        ]
+
+
+def test_upgrade_adds_the_missing_columns(app, client, photo_id):
+    drop_added_columns(app)
+    assert missing_columns(app) == [column.key for column in ADDED_COLUMNS]
+
+    runner = app.test_cli_runner()
+    for _ in range(2):
+        # A second run finds the columns and does nothing
+        result = runner.invoke(args=["database", "upgrade"])
+        assert result.exit_code == 0, result.output
+    assert missing_columns(app) == []
+
+    response = client.post("/auth/login", json={"username": "ana", "password": "password"})
+    assert response.status_code == 200
@@ -0,0 +1,56 @@
+"""The JSON endpoints must not read the image columns, the images are only read by the routes serving them."""
+
+import re
+import pytest
+from conftest import count_statements
+
+# An image column in the selected columns of a statement (its hash columns or a NULL check do not read the image)
+IMAGE_COLUMN = re.compile(r"\b(photo\.photo|patient\.profile_photo|\"?user\"?\.profile_picture)\b(?!\s+IS\b)")
+
+ENDPOINTS = [
+    "/auth/renew_token",
+    "/users/information",
+    "/patients/information/{patient_id}",
+    "/patients/information/{patient_id}/photos",
+    "/patients/search?s=*",
+    "/patients/search?s=re",
+    "/owners/search?s=*",
+    "/owners/search?s=jo",
+    "/owners/get/information/{owner_id}",
+    "/patients/collection/photos/{photo_id}/analysis",
+]
+
+
+def selected_columns(statement: str) -> str:
+    """The columns of a SELECT, up to its first FROM"""
+    return statement.split(" FROM ", 1)[0] if statement.lstrip().upper().startswith("SELECT") else ""
+
+
+def assert_no_image_read(statements: list) -> None:
+    reads = [statement for statement in statements if IMAGE_COLUMN.search(selected_columns(statement))]
+    assert not reads, f"image columns read: {reads}"
+
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+def test_json_endpoints_do_not_read_images(app, client, headers, owner_id, patient_id, photo_id, endpoint):
+    url = endpoint.format(owner_id=owner_id, patient_id=patient_id, photo_id=photo_id)
+    with app.app_context(), count_statements() as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert statements
+    assert_no_image_read(statements)
+
+
+def test_login_does_not_read_images(app, client, user_id, patient_id):
+    with app.app_context(), count_statements() as statements:
+        response = client.post("/auth/login", json={"username": "ana", "password": "password"})
+    assert response.status_code == 200
+    assert_no_image_read(statements)
+
+
+def test_image_routes_read_images(app, client, patient_id, photo_id):
+    # The pattern does find the image columns, the serving routes select them
+    with app.app_context(), count_statements() as statements:
+        response = client.get(f"/patients/collection/photos/{photo_id}")
+    assert response.status_code == 200
+    assert any(IMAGE_COLUMN.search(selected_columns(statement)) for statement in statements)
@@ -0,0 +1,57 @@
+"""The predictions of the stored photos: they mark the analysis as done and reuse the prediction made at upload."""
+
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from conftest import stub_predictions
+from app.models import Photo, db
+from app.routes.resnet_model import resnet_model as resnet_routes
+
+
+def fail_analysis(app, photo_id: int) -> None:
+    with app.app_context():
+        photo = db.session.get(Photo, photo_id)
+        photo.analysis_status, photo.analysis_error = "failed", "timeout"
+        db.session.commit()
+
+
+def predict(client, headers, photo_id: int, route: str):
+    if route == "photo":
+        return client.get(f"/resnet/predict/photo/{photo_id}", headers=headers)
+    return client.post("/resnet/predict/batch", headers=headers, json={"photo_ids": [photo_id]})
+
+
+@pytest.mark.parametrize("route", ["photo", "batch"])
+def test_prediction_marks_the_analysis_done(app, client, headers, photo_id, route):
+    fail_analysis(app, photo_id)
+    response = predict(client, headers, photo_id, route)
+    assert response.status_code == 200
+
+    analysis = client.get(f"/patients/collection/photos/{photo_id}/analysis", headers=headers).get_json()
+    assert analysis["status"] == "done"
+    assert analysis["error"] is None
+
+
+def test_upload_and_stored_photo_share_the_prediction(app, client, headers, patient_id, monkeypatch):
+    calls = []
+
+    def counted_predictions(images, model, device):
+        calls.append(len(images))
+        return stub_predictions(images, model, device)
+
+    monkeypatch.setattr(resnet_routes, "get_predictions", counted_predictions)
+    rng = np.random.default_rng(0)
+    data = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (768, 1024, 3), dtype=np.uint8)).save(data, format="JPEG")
+    data.seek(0)
+    response = client.post(
+        "/patients/collection/photos/add", headers=headers, data={"patient_id": patient_id, "photo": (data, "a.jpg")}
+    )
+    assert response.status_code == 201
+    assert calls == [1]
+
+    # The stored photo is the same input of the model as the upload, its prediction is in the cache
+    response = client.get(f"/resnet/predict/photo/{response.get_json()['photo']['id']}", headers=headers)
+    assert response.status_code == 200
+    assert calls == [1]
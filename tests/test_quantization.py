@@ -0,0 +1,18 @@
+"""The int8 model is only built with calibration images, it is never silently a partly quantized model."""
+
+import pytest
+import torch
+from app.utils.quantization import prepare_model
+
+
+@pytest.mark.parametrize("calibration_dir", [None, "empty"])
+def test_int8_requires_calibration_images(tmp_path, calibration_dir):
+    if calibration_dir:
+        calibration_dir = str(tmp_path)
+    with pytest.raises(ValueError, match="INFERENCE_CALIBRATION_DIR"):
+        prepare_model(torch.nn.Linear(4, 4), "int8", calibration_dir)
+
+
+def test_fp32_is_the_model():
+    model = torch.nn.Linear(4, 4)
+    assert prepare_model(model, "fp32") is model
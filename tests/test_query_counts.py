@@ -0,0 +1,58 @@
+"""The serialized relationships are loaded up front: the number of statements of an endpoint does not grow with the
+patients and photos it returns."""
+
+import pytest
+from conftest import count_statements, image
+from app.models import Owner, Patient, Photo, db
+
+# Statements of every endpoint, the token lookup included
+EXPECTED_STATEMENTS = {
+    "login": 4,
+    "renew_token": 4,
+    "users_information": 5,
+    "search_patients": 3,
+    "search_owners": 4,
+    "owner_information": 4,
+}
+
+
+def add_patients(user_id: int, owner_id: int, patients: int, photos: int) -> None:
+    """Add patients with photos to the owner"""
+    data = image().getvalue()
+    for index in range(patients):
+        patient = Patient(nickname=f"Rex{index}", age=2, weight=5.0, user_id=user_id, owner_id=owner_id)
+        db.session.add(patient)
+        db.session.flush()
+        for _ in range(photos):
+            db.session.add(Photo(photo=data, filename="a.jpg", patient_id=patient.id))
+    db.session.add(Owner(first_name="Li", last_name="Ma", email="li@x.com", phone_number="912345678", document="9",
+                         user_id=user_id))
+    db.session.commit()
+
+
+def request_endpoint(client, headers, owner_id: int, endpoint: str):
+    if endpoint == "login":
+        return client.post("/auth/login", json={"username": "ana", "password": "password"})
+    urls = {
+        "renew_token": "/auth/renew_token",
+        "users_information": "/users/information",
+        "search_patients": "/patients/search?s=*",
+        "search_owners": "/owners/search?s=*",
+        "owner_information": f"/owners/get/information/{owner_id}",
+    }
+    return client.get(urls[endpoint], headers=headers)
+
+
+def statements_of(app, client, headers, owner_id: int, endpoint: str) -> int:
+    with app.app_context(), count_statements() as statements:
+        response = request_endpoint(client, headers, owner_id, endpoint)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize("endpoint", EXPECTED_STATEMENTS)
+def test_statements_do_not_grow_with_the_results(app, client, headers, user_id, owner_id, photo_id, endpoint):
+    assert statements_of(app, client, headers, owner_id, endpoint) == EXPECTED_STATEMENTS[endpoint]
+    with app.app_context():
+        add_patients(user_id, owner_id, patients=6, photos=3)
+    assert statements_of(app, client, headers, owner_id, endpoint) == EXPECTED_STATEMENTS[endpoint]
@@ -0,0 +1,163 @@
+"""The requests writing several rows commit them once, and a failure halfway leaves no row behind."""
+
+import time
+import pytest
+from conftest import count_commits, image
+from app.models import Owner, Patient, Photo, Thumbnail, User, commit_session, db, rollback_session
+from app.routes.patient import patient as patient_routes
+from app.utils import thumbnails
+
+
+def generate_data(email: str = "li@x.com") -> dict:
+    return {
+        "first_name": "Li",
+        "last_name": "Ma",
+        "email": email,
+        "phone_number": "912345678",
+        "document": "9",
+        "nickname": "Max",
+        "age": 2,
+        "weight": 5,
+        "profile_photo": (image((1, 2, 3)), "p.jpg"),
+        "analyzed_photo": (image((4, 5, 6)), "a.png"),
+    }
+
+
+def row_counts(app) -> tuple:
+    with app.app_context():
+        return Owner.query.count(), Patient.query.count(), Photo.query.count()
+
+
+def test_generate_commits_once(app, client, headers):
+    with app.app_context(), count_commits() as commits:
+        response = client.post("/patients/generate", headers=headers, data=generate_data())
+    assert response.status_code == 201
+    assert len(commits) == 1
+    assert row_counts(app) == (1, 1, 1)
+
+
+def test_add_photo_commits_once(app, client, headers, patient_id):
+    with app.app_context(), count_commits() as commits:
+        response = client.post(
+            "/patients/collection/photos/add",
+            headers=headers,
+            data={"patient_id": patient_id, "photo": (image((7, 8, 9)), "a.jpg")},
+        )
+    assert response.status_code == 201
+    assert response.get_json()["photo"]["predicted_class"] == "sano"
+    assert len(commits) == 1
+
+
+def test_add_photo_async_commits_once(app, client, headers, patient_id):
+    with app.app_context(), count_commits() as commits:
+        response = client.post(
+            "/patients/collection/photos/add",
+            headers=headers,
+            data={"patient_id": patient_id, "async": "true", "photo": (image((9, 8, 7)), "a.jpg")},
+        )
+    assert response.status_code == 202
+    assert len(commits) == 1
+    # The analysis commits apart, in the background pool
+    status_url = f"/patients/collection/photos/{response.get_json()['photo']['id']}/analysis"
+    for _ in range(50):
+        status = client.get(status_url, headers=headers).get_json()["status"]
+        if status != "pending":
+            break
+        time.sleep(0.05)
+    assert status == "done"
+
+
+@pytest.mark.parametrize(
+    "method, url, kwargs",
+    [
+        ("put", "/patients/update/information/{patient_id}", {"json": {"nickname": "Rexo", "age": 4, "weight": 11}}),
+        (
+            "put",
+            "/patients/update/profile_photo/{patient_id}",
+            {"data": {"profile_photo": (image((3, 3, 3)), "p.jpg")}},
+        ),
+        (
+            "put",
+            "/owners/update/information/{owner_id}",
+            {
+                "json": {
+                    "first_name": "Jo",
+                    "last_name": "Da",
+                    "email": "jo@x.com",
+                    "phone_number": "912345678",
+                    "document": "1",
+                }
+            },
+        ),
+        (
+            "put",
+            "/users/update/information",
+            {
+                "json": {
+                    "first_name": "Ana",
+                    "last_name": "Perez",
+                    "clinic": "Vet",
+                    "address": "Street 1",
+                    "college_number": "A1",
+                }
+            },
+        ),
+        (
+            "put",
+            "/users/update/password",
+            {"json": {"actual_password": "password", "new_password": "password", "confirm_password": "password"}},
+        ),
+    ],
+)
+def test_updates_commit_once(app, client, headers, owner_id, patient_id, method, url, kwargs):
+    url = url.format(owner_id=owner_id, patient_id=patient_id)
+    with app.app_context(), count_commits() as commits:
+        response = getattr(client, method)(url, headers=headers, **kwargs)
+    assert response.status_code == 200
+    assert len(commits) == 1
+
+
+def test_confirm_email_commits_once(app, client, user_id):
+    with app.app_context():
+        token = User.generate_confirmation_token(user_id)
+    with app.app_context(), count_commits() as commits:
+        response = client.get(f"/auth/confirm_email/{token}")
+    assert response.status_code == 200
+    assert len(commits) == 1
+
+
+def test_generate_failure_leaves_no_rows(app, client, headers, monkeypatch):
+    create_new_photo = patient_routes.create_new_photo
+
+    def failing_create_new_photo(data):
+        create_new_photo(data)
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(patient_routes, "create_new_photo", failing_create_new_photo)
+    with app.app_context(), count_commits() as commits:
+        response = client.post("/patients/generate", headers=headers, data=generate_data())
+    assert response.status_code == 500
+    assert response.get_json()["error"] == "disk full"
+    assert len(commits) == 0
+    assert row_counts(app) == (0, 0, 0)
+
+
+def test_thumbnail_failure_keeps_the_unit(app, client, headers, monkeypatch):
+    def failing_save_thumbnails(source_hash, images):
+        # Same error handling as save_thumbnails, the flush fails on the missing image
+        db.session.add(Thumbnail(source_hash=source_hash, size=0, image=None))
+        try:
+            commit_session()
+        except Exception as e:
+            rollback_session()
+            raise e
+
+    monkeypatch.setattr(thumbnails, "save_thumbnails", failing_save_thumbnails)
+    with app.app_context(), count_commits() as commits:
+        response = client.post("/patients/generate", headers=headers, data=generate_data())
+    assert response.status_code == 201
+    assert len(commits) == 1
+    with app.app_context():
+        owner = Owner.query.one()
+        assert Patient.query.one().owner_id == owner.id
+        assert Thumbnail.query.count() == 0